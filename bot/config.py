@@ -22,6 +22,7 @@ class Config:
     webhook_url: Optional[str] = None
     openrouter_api_key: Optional[str] = None
     openrouter_fallback_model: str = "qwen/qwen2.5-vl-3b-instruct:free"
+    sequential_log_buffer: bool = False
 
 def load_config() -> Config:
     """Loads configuration from environment variables."""
@@ -44,6 +45,9 @@ def load_config() -> Config:
     # OpenRouter API Key
     openrouter_api_key = os.getenv("OPENROUTER_API_KEY")
 
+    # Sequential log buffer (flat-file message journal instead of per-message DB writes)
+    sequential_log_buffer = os.getenv("SEQUENTIAL_LOG_BUFFER", "false").lower() in ("1", "true", "yes")
+
     # OpenRouter Fallback Model
     openrouter_fallback_model = os.getenv("OPENROUTER_FALLBACK_MODEL", "qwen/qwen2.5-vl-3b-instruct:free")
     if not openrouter_fallback_model:
@@ -107,6 +111,7 @@ def load_config() -> Config:
         ai_model_name=ai_model_name,
         webhook_url=webhook_url,
         openrouter_api_key=openrouter_api_key,
+        sequential_log_buffer=sequential_log_buffer,
     )
 
     logger.info(f"Configuration loaded successfully for bot: {config.bot_name}")
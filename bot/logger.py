@@ -1,11 +1,15 @@
+import asyncio
 import sqlite3
 import logging
 import os
 import aiosqlite
-import json # For serializing entities/media info
+import json # For deserializing stored entities/media info
+import orjson # C-accelerated JSON encoding on the write path
 from datetime import datetime, date, time, timedelta, timezone
 from typing import Dict, List, Tuple, Any # Added Any
 
+from .summarizer import format_message_for_prompt # Prompt lines are materialized at ingest
+
 logger = logging.getLogger(__name__)
 
 DB_DIR = "data"
@@ -62,6 +66,14 @@ async def initialize_db():
             )
             """)
 
+            # Migration: prompt_line holds the pre-rendered summarization
+            # line, computed once at ingest instead of per summary request.
+            async with db.execute("PRAGMA table_info(messages);") as cursor:
+                columns = [row[1] async for row in cursor]
+            if 'prompt_line' not in columns:
+                await db.execute("ALTER TABLE messages ADD COLUMN prompt_line TEXT;")
+                logger.info("Added prompt_line column to messages table.")
+
             # --- New Table: Monitored Chats ---
             await db.execute("""
             CREATE TABLE IF NOT EXISTS monitored_chats (
@@ -91,6 +103,19 @@ async def initialize_db():
             """, (OWNER_USER_ID,))
             # ---------------------------------------
 
+            # --- New Table: Sequential Log File Index ---
+            # Tracks rotated flat-file buffers (see bot/logstore.py) so reads
+            # by time range can locate the right file and stream it.
+            await db.execute("""
+            CREATE TABLE IF NOT EXISTS log_files (
+                path TEXT PRIMARY KEY,
+                ts_min INTEGER NOT NULL, -- earliest record timestamp (ns since epoch)
+                ts_max INTEGER NOT NULL, -- latest record timestamp (ns since epoch)
+                indexed_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """)
+            # --------------------------------------------
+
             await db.commit()
             logger.info(f"Database initialized successfully at {DB_PATH}")
 
@@ -126,25 +151,131 @@ async def log_message(chat_id: int, chat_type: str, chat_title: str | None,
                 ON CONFLICT(user_id) DO NOTHING;
                 """, (sender_id, sender_username, sender_first_name, sender_last_name, 1 if sender_is_bot else 0))
 
-            # Serialize complex data to JSON
-            entities_json = json.dumps(entities) if entities else None
-            media_info_json = json.dumps(media_info) if media_info else None
+            # Serialize complex data to JSON (orjson: C-implemented encoder)
+            entities_json = orjson.dumps(entities).decode() if entities else None
+            media_info_json = orjson.dumps(media_info).decode() if media_info else None
+            prompt_line = format_message_for_prompt({
+                'timestamp': timestamp, 'text': text, 'media_type': media_type,
+                'chat_title': chat_title, 'sender_name': sender_first_name,
+            })
 
             # Insert message, forwarded_to_user defaults to 0
             await db.execute("""
-            INSERT INTO messages (message_id, chat_id, sender_id, timestamp, text, entities, media_type, media_info)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            INSERT INTO messages (message_id, chat_id, sender_id, timestamp, text, entities, media_type, media_info, prompt_line)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
             ON CONFLICT(chat_id, message_id) DO NOTHING;
-            """, (message_id, chat_id, sender_id, timestamp, text, entities_json, media_type, media_info_json))
+            """, (message_id, chat_id, sender_id, timestamp, text, entities_json, media_type, media_info_json, prompt_line))
 
             await db.commit()
-            logger.debug(f"Logged message {message_id} from chat {chat_id} (Media: {media_type or 'None'})")
+            logger.debug("Logged message %s from chat %s (Media: %s)", message_id, chat_id, media_type or 'None')
 
     except sqlite3.Error as e:
         logger.error(f"Database error logging message {message_id} in chat {chat_id}: {e}", exc_info=True)
     except Exception as e:
         logger.error(f"Unexpected error logging message {message_id} in chat {chat_id}: {e}", exc_info=True)
 
+# Long-lived connection for the bulk write path. Re-opening a connection per
+# batch would re-pay connection setup and re-parse the statements; keeping one
+# open lets SQLite reuse its prepared-statement cache, and WAL +
+# synchronous=NORMAL trades a sliver of durability for group-commit
+# throughput on the hot insert path.
+_write_db: "aiosqlite.Connection | None" = None
+# Serializes bulk transactions on the shared connection: the log and
+# forwarded writers run in independent tasks and must not interleave
+# statements inside one another's open transaction.
+_write_lock = asyncio.Lock()
+
+async def _get_write_db() -> aiosqlite.Connection:
+    """Returns the shared bulk-writer connection, opening it on first use."""
+    global _write_db
+    if _write_db is None:
+        _write_db = await aiosqlite.connect(DB_PATH)
+        await configure_db_pragmas(_write_db)
+        logger.info("Opened persistent bulk-writer DB connection (WAL, synchronous=NORMAL).")
+    return _write_db
+
+async def configure_db_pragmas(db: aiosqlite.Connection | None = None):
+    """Applies write-throughput pragmas to a connection (default: writer).
+
+    WAL + synchronous=NORMAL means a commit is an append without an fsync
+    per transaction — on power loss the last moments of traffic may be
+    lost, which is an acceptable trade for a passive message log.
+    """
+    if db is None:
+        db = await _get_write_db()
+        return  # _get_write_db already configured it on open
+    await db.execute("PRAGMA journal_mode=WAL;")
+    await db.execute("PRAGMA synchronous=NORMAL;")
+    await db.execute("PRAGMA foreign_keys=ON;")
+    await db.execute("PRAGMA temp_store=MEMORY;")
+    await db.execute("PRAGMA cache_size=-65536;")      # 64 MiB page cache
+    await db.execute("PRAGMA wal_autocheckpoint=1000;")
+
+async def close_write_db():
+    """Closes the shared bulk-writer connection (call on shutdown)."""
+    global _write_db
+    if _write_db is not None:
+        await _write_db.close()
+        _write_db = None
+
+async def log_messages_bulk(batch: List[Dict[str, Any]]):
+    """Logs a batch of message records in a single transaction.
+
+    Each record is a dict with the same fields as log_message's parameters.
+    Coalescing N messages into one commit amortizes the per-transaction
+    fsync and connection overhead that dominates the per-message path.
+    """
+    if not batch:
+        return
+    chat_rows = []
+    user_rows = []
+    message_rows = []
+    for rec in batch:
+        chat_rows.append((rec['chat_id'], rec['chat_type'], rec['chat_title'], rec['chat_username']))
+        if rec['sender_id'] is not None:
+            user_rows.append((rec['sender_id'], rec['sender_username'], rec['sender_first_name'],
+                              rec['sender_last_name'], 1 if rec['sender_is_bot'] else 0))
+        entities_json = orjson.dumps(rec['entities']).decode() if rec['entities'] else None
+        media_info_json = orjson.dumps(rec['media_info']).decode() if rec['media_info'] else None
+        prompt_line = format_message_for_prompt({
+            'timestamp': rec['timestamp'], 'text': rec['text'], 'media_type': rec['media_type'],
+            'chat_title': rec['chat_title'], 'sender_name': rec['sender_first_name'],
+        })
+        message_rows.append((rec['message_id'], rec['chat_id'], rec['sender_id'], rec['timestamp'],
+                             rec['text'], entities_json, rec['media_type'], media_info_json, prompt_line))
+    try:
+        db = await _get_write_db()
+        async with _write_lock:
+            try:
+                # OR IGNORE rather than ON CONFLICT(pk) DO NOTHING: usernames are
+                # UNIQUE too, and a reassigned username would otherwise raise
+                # IntegrityError and abort the whole batch over one stale row.
+                await db.executemany("""
+                INSERT OR IGNORE INTO chats (chat_id, type, title, username)
+                VALUES (?, ?, ?, ?);
+                """, chat_rows)
+                if user_rows:
+                    await db.executemany("""
+                    INSERT OR IGNORE INTO users (user_id, username, first_name, last_name, is_bot)
+                    VALUES (?, ?, ?, ?, ?);
+                    """, user_rows)
+                await db.executemany("""
+                INSERT INTO messages (message_id, chat_id, sender_id, timestamp, text, entities, media_type, media_info, prompt_line)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(chat_id, message_id) DO NOTHING;
+                """, message_rows)
+                await db.commit()
+            except BaseException:
+                # Discard the partial transaction; on the shared connection it
+                # would otherwise be committed by the next successful batch.
+                await db.rollback()
+                raise
+        logger.debug("Logged batch of %d messages in one transaction.", len(batch))
+    except sqlite3.Error as e:
+        logger.error(f"Database error logging batch of {len(batch)} messages: {e}", exc_info=True)
+    except Exception as e:
+        logger.error(f"Unexpected error logging batch of {len(batch)} messages: {e}", exc_info=True)
+
 async def mark_message_forwarded(chat_id: int, message_id: int):
     """Marks a specific message as forwarded in the database."""
     try:
@@ -155,12 +286,42 @@ async def mark_message_forwarded(chat_id: int, message_id: int):
             WHERE chat_id = ? AND message_id = ? AND forwarded_to_user = 0
             """, (chat_id, message_id))
             await db.commit()
-            logger.debug(f"Marked message {message_id} in chat {chat_id} as forwarded.")
+            logger.debug("Marked message %s in chat %s as forwarded.", message_id, chat_id)
     except sqlite3.Error as e:
         logger.error(f"DB error marking message {message_id}/{chat_id} forwarded: {e}", exc_info=True)
     except Exception as e:
         logger.error(f"Unexpected error marking message {message_id}/{chat_id} forwarded: {e}", exc_info=True)
 
+async def mark_messages_forwarded_bulk(refs: List[tuple]):
+    """Marks a batch of (chat_id, message_id) pairs forwarded in one commit.
+
+    A digest covers many messages; executemany on the shared writer turns
+    N single-row transactions into one, the same amortization as
+    log_messages_bulk.
+    """
+    if not refs:
+        return
+    try:
+        db = await _get_write_db()
+        async with _write_lock:
+            try:
+                await db.executemany("""
+                UPDATE messages
+                SET forwarded_to_user = 1
+                WHERE chat_id = ? AND message_id = ? AND forwarded_to_user = 0
+                """, refs)
+                await db.commit()
+            except BaseException:
+                # Same as log_messages_bulk: never leave a partial
+                # transaction pending on the shared connection.
+                await db.rollback()
+                raise
+        logger.debug("Marked %d message(s) as forwarded.", len(refs))
+    except sqlite3.Error as e:
+        logger.error(f"DB error bulk-marking {len(refs)} message(s) forwarded: {e}", exc_info=True)
+    except Exception as e:
+        logger.error(f"Unexpected error bulk-marking {len(refs)} message(s) forwarded: {e}", exc_info=True)
+
 async def get_unforwarded_summary() -> Dict[str, int]:
     """Gets a summary of unforwarded messages (e.g., count per chat)."""
     summary = {}
@@ -195,7 +356,8 @@ async def get_messages_since(timestamp: datetime) -> List[Dict[str, Any]]:
             query = """
             SELECT m.timestamp, m.text, m.entities, m.media_type,
                    c.title as chat_title, c.type as chat_type,
-                   u.first_name as sender_name, u.is_bot as sender_is_bot
+                   u.first_name as sender_name, u.is_bot as sender_is_bot,
+                   m.chat_id, m.message_id, m.prompt_line
             FROM messages m
             LEFT JOIN chats c ON m.chat_id = c.chat_id
             LEFT JOIN users u ON m.sender_id = u.user_id
@@ -213,7 +375,10 @@ async def get_messages_since(timestamp: datetime) -> List[Dict[str, Any]]:
                         "chat_title": row[4],
                         "chat_type": row[5],
                         "sender_name": row[6],
-                        "sender_is_bot": bool(row[7])
+                        "sender_is_bot": bool(row[7]),
+                        "chat_id": row[8],
+                        "message_id": row[9],
+                        "prompt_line": row[10]
                     }
                     messages.append(msg_data)
             logger.info(f"Retrieved {len(messages)} messages since {timestamp} for summarization.")
@@ -241,7 +406,7 @@ async def get_db_stats() -> Dict[str, int]:
             async with db.execute("SELECT COUNT(*) FROM users") as cursor:
                 result = await cursor.fetchone()
                 if result: stats["total_users"] = result[0]
-            logger.debug(f"Retrieved DB stats: {stats}")
+            logger.debug("Retrieved DB stats: %s", stats)
     except sqlite3.Error as e:
         logger.error(f"DB error getting stats: {e}", exc_info=True)
         # Return default stats on error
@@ -250,6 +415,41 @@ async def get_db_stats() -> Dict[str, int]:
         # Return default stats on error
     return stats
 
+# --- Sequential Log File Index Functions ---
+
+async def record_log_file(path: str, ts_min: int, ts_max: int):
+    """Records a rotated sequential log file's bounds in the index.
+
+    Bounds are merged on conflict so re-indexing a file (e.g. after a
+    restart appended to it) widens its range instead of replacing it.
+    """
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.execute("""
+            INSERT INTO log_files (path, ts_min, ts_max)
+            VALUES (?, ?, ?)
+            ON CONFLICT(path) DO UPDATE SET
+                ts_min=MIN(ts_min, excluded.ts_min),
+                ts_max=MAX(ts_max, excluded.ts_max);
+            """, (path, ts_min, ts_max))
+            await db.commit()
+            logger.info(f"Indexed sequential log file: {path} ({ts_min}..{ts_max})")
+    except Exception as e:
+        logger.error(f"Error indexing log file {path}: {e}", exc_info=True)
+
+async def get_log_files_for_range(ts_min: int, ts_max: int) -> List[str]:
+    """Returns paths of indexed log files overlapping the given ns time range."""
+    paths = []
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            query = "SELECT path FROM log_files WHERE ts_max >= ? AND ts_min <= ? ORDER BY ts_min ASC"
+            async with db.execute(query, (ts_min, ts_max)) as cursor:
+                async for row in cursor:
+                    paths.append(row[0])
+    except Exception as e:
+        logger.error(f"Error querying log file index: {e}", exc_info=True)
+    return paths
+
 # --- Monitored Chat Functions ---
 
 async def add_monitored_chat(chat_id: int, title: str | None, username: str | None):
@@ -522,7 +722,7 @@ async def query_messages(chat_filter: str | int | None = None,
             """
             params.append(limit)
 
-            logger.debug(f"Executing query: {sql} with params: {params}")
+            logger.debug("Executing query: %s with params: %s", sql, params)
             async with db.execute(sql, params) as cursor:
                 column_names = [desc[0] for desc in cursor.description]
                 async for row in cursor:
@@ -0,0 +1,135 @@
+import asyncio
+import json
+import logging
+import os
+import struct
+import time
+from typing import Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LOG_DIR = os.path.join("sessions", "logs")
+MAX_FILE_BYTES = 1 << 30  # Rotate after 1 GiB
+
+# 64-byte record header: timestamp_ns, type_id, body_length + padding.
+_RECORD_HEADER = struct.Struct('<QQQ40x')
+
+RECORD_TYPE_MESSAGE = 1
+
+
+class SequentialLogStore:
+    """Append-only sequential buffer for raw observation records.
+
+    Records are framed with a fixed 64-byte header (timestamp_ns, type_id,
+    body length) followed by a JSON body, appended to an hourly log file
+    under sessions/logs/. Files rotate at 1 GiB — size rotations within an
+    hour get a .N sequence suffix so a rotated file is never reopened — and
+    on rotation the closed file's path and timestamp bounds are recorded in
+    the SQL index (log_files table) so time-range reads can locate the
+    right file and stream it sequentially. Turns per-message random DB
+    writes into pure buffered sequential writes.
+    """
+
+    def __init__(self, directory: str = LOG_DIR, max_file_bytes: int = MAX_FILE_BYTES):
+        self.directory = directory
+        self.max_file_bytes = max_file_bytes
+        self._file = None
+        self._file_path: Optional[str] = None
+        self._file_hour: Optional[str] = None
+        self._file_seq = 0
+        self._bytes_written = 0
+        self._ts_min: Optional[int] = None
+        self._ts_max: Optional[int] = None
+        self._index_tasks: set = set()  # Strong refs so index writes survive GC
+        os.makedirs(self.directory, exist_ok=True)
+
+    def append(self, record: dict, type_id: int = RECORD_TYPE_MESSAGE) -> None:
+        """Appends a single record (dict) as header + JSON body. Buffered write."""
+        timestamp_ns = time.time_ns()
+        body = json.dumps(record, default=str).encode('utf-8')
+        self._ensure_file(timestamp_ns)
+        self._file.write(_RECORD_HEADER.pack(timestamp_ns, type_id, len(body)))
+        self._file.write(body)
+        self._bytes_written += _RECORD_HEADER.size + len(body)
+        if self._ts_min is None:
+            self._ts_min = timestamp_ns
+        self._ts_max = timestamp_ns
+
+    def _ensure_file(self, timestamp_ns: int) -> None:
+        """Opens the current hourly file, rotating on hour change or size limit."""
+        hour = time.strftime('%Y%m%d%H', time.gmtime(timestamp_ns / 1e9))
+        if self._file is not None:
+            if hour == self._file_hour and self._bytes_written < self.max_file_bytes:
+                return
+            # Size rotation within the hour moves to the next sequence
+            # suffix; reopening the just-rotated path would rotate again on
+            # every append and re-index the same file with fresh bounds.
+            self._file_seq = self._file_seq + 1 if hour == self._file_hour else 0
+            self._rotate()
+        elif hour != self._file_hour:
+            self._file_seq = 0
+        # Skip segments already at the size limit — a restart within the
+        # hour must not reopen (and later re-index) a full segment.
+        while True:
+            suffix = '' if self._file_seq == 0 else f".{self._file_seq}"
+            path = os.path.join(self.directory, f"{hour}{suffix}.log")
+            try:
+                if os.path.getsize(path) < self.max_file_bytes:
+                    break
+            except OSError:
+                break  # Doesn't exist yet: fresh segment.
+            self._file_seq += 1
+        self._file_hour = hour
+        self._file_path = path
+        self._file = open(self._file_path, 'ab')
+        self._bytes_written = self._file.tell()
+        self._ts_min = None
+        self._ts_max = None
+        logger.info(f"Sequential log store writing to {self._file_path}")
+
+    def _rotate(self) -> None:
+        """Closes the current file and schedules its bounds for SQL indexing."""
+        self._file.close()
+        path, ts_min, ts_max = self._file_path, self._ts_min, self._ts_max
+        self._file = None
+        if ts_min is not None:
+            # Index asynchronously; appends must stay a pure buffered write.
+            try:
+                loop = asyncio.get_running_loop()
+                task = loop.create_task(self._index_file(path, ts_min, ts_max))
+                self._index_tasks.add(task)
+                task.add_done_callback(self._index_tasks.discard)
+            except RuntimeError:
+                logger.warning(f"No running loop; log file {path} left unindexed.")
+
+    @staticmethod
+    async def _index_file(path: str, ts_min: int, ts_max: int) -> None:
+        # Imported here to avoid a circular import at module load.
+        from .logger import record_log_file
+        await record_log_file(path, ts_min, ts_max)
+
+    async def close(self) -> None:
+        """Flushes and indexes the currently open file."""
+        if self._file is None:
+            return
+        self._file.flush()
+        self._file.close()
+        path, ts_min, ts_max = self._file_path, self._ts_min, self._ts_max
+        self._file = None
+        if ts_min is not None:
+            await self._index_file(path, ts_min, ts_max)
+
+
+def iter_records(path: str) -> Iterator[Tuple[int, int, dict]]:
+    """Streams (timestamp_ns, type_id, record) tuples from a closed log file."""
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(_RECORD_HEADER.size)
+            if len(header) < _RECORD_HEADER.size:
+                break
+            timestamp_ns, type_id, body_len = _RECORD_HEADER.unpack(header)
+            body = f.read(body_len)
+            if len(body) < body_len:
+                logger.warning(f"Truncated record at end of {path}")
+                break
+            yield timestamp_ns, type_id, json.loads(body)
@@ -1,21 +1,34 @@
 import logging
 import asyncio # Added for potential delays
-import json # For link extraction from entities
+import os # For the persisted entity-id cache
+import collections # For the dedupe LRU
+import functools # For the timestamp-format LRU
+from time import monotonic # For TTL caches (datetime.time is imported below)
+import json # For small one-off dumps (AI filter echo)
+import orjson # Fast decode of stored entities JSON on the query path
 import re # For link extraction from text
 from telethon import TelegramClient, events
 from telethon.tl.functions.channels import JoinChannelRequest
-from telethon.errors import FloodWaitError, UserAlreadyParticipantError, ChannelsTooMuchError, ChannelInvalidError, ChannelPrivateError, InviteHashExpiredError, UserIsBlockedError
+from telethon.errors import RPCError, FloodWaitError, UserAlreadyParticipantError, ChannelsTooMuchError, ChannelInvalidError, ChannelPrivateError, InviteHashExpiredError, UserIsBlockedError
 # Peer types for type checking
-from telethon.tl.types import PeerUser, PeerChat, PeerChannel
+from telethon.tl.types import PeerUser, PeerChat, PeerChannel, User
 # Import specific media types for checking
 from telethon.tl.types import MessageMediaPhoto, MessageMediaDocument, MessageMediaWebPage
+from telethon.tl.types import DocumentAttributeFilename, DocumentAttributeSticker
+# Entity types for the manual serializer
+from telethon.tl.types import (
+    MessageEntityUrl, MessageEntityTextUrl, MessageEntityMention, MessageEntityMentionName,
+    MessageEntityHashtag, MessageEntityBotCommand, MessageEntityEmail, MessageEntityPhone,
+    MessageEntityBold, MessageEntityItalic, MessageEntityCode, MessageEntityPre,
+)
 from datetime import datetime, date, time, timezone # Import date/time for summary command
 
 from .config import Config
 from .logger import (
-    log_message, mark_message_forwarded, get_unforwarded_summary, get_messages_since,
+    log_messages_bulk, configure_db_pragmas, close_write_db,
+    mark_messages_forwarded_bulk, get_unforwarded_summary, get_messages_since,
     add_monitored_chat, remove_monitored_chat, list_monitored_chats,
-    is_chat_monitored, is_any_chat_monitored, clear_monitored_chats,
+    clear_monitored_chats,
     # New target functions
     add_notification_target, remove_notification_target, list_notification_targets,
     get_all_notification_target_ids, OWNER_USER_ID, # Need owner ID for checks
@@ -23,332 +36,852 @@ from .logger import (
     query_messages
 )
 from .summarizer import get_ai_summary, extract_query_params_from_nlp # Import new NLP function
+from .logstore import SequentialLogStore
 
 logger = logging.getLogger(__name__)
 
 # FORWARD_TARGET_USER_ID constant is no longer the primary control, use OWNER_USER_ID instead
-_BOT_USER_ID = None
-is_forwarding_active = True
+# Sender ids the hot path drops outright. Populated with our own id at
+# startup; a frozenset so the empty pre-login state and the steady state
+# share one membership test (and more ids can be added later).
+_IGNORED_SENDERS: frozenset = frozenset()
+
+class ObserverState:
+    """Mutable runtime state shared between the handler and commands.
+
+    Attribute reads on a slotted instance bound to a local are cheaper than
+    module-global lookups, and avoid `global` statements in every mutator.
+    """
+    __slots__ = ('forwarding',)
+
+    def __init__(self):
+        self.forwarding = True
+
+# Singleton; also attached to the client in start_observer so handlers can
+# reach it via event.client.state without importing this module.
+_state = ObserverState()
+
+# Per-chat notify overrides. The hot-path gate is a single dict get with the
+# forwarding flag as the default; per-chat rules (e.g. future webhook triggers)
+# slot in here without growing the per-message predicate chain.
+_chat_notify: dict[int, bool] = {}
+# Optional append-only flat-file buffer (set in start_observer when enabled)
+_log_store: SequentialLogStore | None = None
+
+# In-memory mirrors of the monitor list and notification targets. The hot
+# path does O(1) membership checks against these instead of two awaited DB
+# queries per message; the command handlers that mutate the underlying
+# tables are the only writers, and they refresh the mirrors afterwards.
+_monitored_ids: frozenset = frozenset()
+_notify_target_ids: tuple = ()
+_monitor_lock = asyncio.Lock()
+
+async def _reload_monitored():
+    """Rebuilds the cached monitor set from the database."""
+    global _monitored_ids
+    async with _monitor_lock:
+        chats = await list_monitored_chats()
+        _monitored_ids = frozenset(c['chat_id'] for c in chats)
+
+_MONITOR_REFRESH_INTERVAL = 30.0  # seconds between fallback cache reloads
+_monitor_refresher_task: asyncio.Task | None = None
+
+async def _monitor_refresher():
+    """Periodically re-syncs the cached monitor set and notify targets.
+
+    Commands refresh the caches eagerly; this is only a fallback so edits
+    made behind the bot's back (another process writing the DB) converge
+    within _MONITOR_REFRESH_INTERVAL instead of never.
+    """
+    while True:
+        await asyncio.sleep(_MONITOR_REFRESH_INTERVAL)
+        try:
+            await _reload_monitored()
+            await _reload_notify_targets()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Monitor cache refresh failed: {e}")
+
+async def _reload_notify_targets():
+    """Rebuilds the cached notification target tuple from the database."""
+    global _notify_target_ids
+    # Order-preserving dedupe; duplicates would mean duplicate sends.
+    ids = tuple(dict.fromkeys(await get_all_notification_target_ids()))
+    _notify_target_ids = ids
+    # Pre-warm the InputPeer cache here, off the send path, so the first
+    # digest after a refresh doesn't pay per-target entity resolution.
+    client = _client
+    if client is not None:
+        for tid in ids:
+            try:
+                await _get_input_peer(client, tid)
+            except Exception as e:
+                logger.warning(f"Could not pre-resolve notification target {tid}: {e}")
+
+# A chat's peer type is fixed for the session's lifetime, so classify once
+# per chat_id instead of re-running the isinstance chain on every message.
+_chat_type_cache: dict[int, str] = {}
+
+# Branchless peer classification: type(peer_id) keyed lookup instead of an
+# isinstance ladder. None marks PeerChannel, which still needs the broadcast
+# flag to tell channels from supergroups.
+_PEER_KIND = {PeerUser: 'user', PeerChat: 'group', PeerChannel: None}
+
+# Telethon can re-deliver NewMessage events after a reconnect. Track recently
+# seen (chat_id, message_id) pairs in a small LRU so duplicates are dropped
+# before any logging or forwarding work happens.
+_seen: collections.OrderedDict = collections.OrderedDict()
+_SEEN_MAX = 50_000
+
+# Notification delivery runs as fire-and-forget tasks so the handler is not
+# blocked on Telegram acks; the semaphore bounds in-flight sends and the task
+# set keeps references alive until completion (exceptions are logged inside).
+_fwd_sem = asyncio.Semaphore(8)
+_bg_tasks: set = set()
+
+# Per-target flood-wait deadlines (monotonic seconds). Targets under a
+# penalty are skipped during digest fan-out instead of sleeping inline.
+_flood_until: dict[int, float] = {}
+
+# The single TelegramClient used by this process, set once in start_observer.
+# Hot code uses this instead of re-reading (and null-checking) event.client
+# per message; it also lets other modules reuse the client without threading
+# it through call chains.
+_client: TelegramClient | None = None
+
+# DB write coalescing: the handler pushes log records onto this queue and a
+# background writer drains them into a single bulk-insert transaction,
+# amortizing commit/fsync cost across bursts instead of paying it per message.
+_log_queue: asyncio.Queue = asyncio.Queue(maxsize=10_000)
+_log_writer_task: asyncio.Task | None = None
+_LOG_BATCH_MAX = 128
+_LOG_BATCH_WINDOW = 0.05  # seconds to wait for more rows once one arrives
+
+async def _log_writer():
+    """Drains the log queue into bulk inserts. Runs for the observer's lifetime."""
+    loop = asyncio.get_running_loop()
+    while True:
+        first = await _log_queue.get()
+        batch = [first]
+        # Collect rows until the batch cap or the coalescing deadline is
+        # hit: a lone message on an idle queue still flushes within one
+        # window, while a burst fills a whole transaction.
+        deadline = loop.time() + _LOG_BATCH_WINDOW
+        while len(batch) < _LOG_BATCH_MAX:
+            if not _log_queue.empty():
+                batch.append(_log_queue.get_nowait())
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(_log_queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        # Entity serialization deferred from the handler: the dict building
+        # happens here, once per drained record, off the hot path.
+        for record in batch:
+            record['entities'] = _serialize_entities(record['entities'])
+        try:
+            await log_messages_bulk(batch)
+        except Exception as e:
+            logger.error(f"Log writer failed to flush batch of {len(batch)}: {e}", exc_info=True)
+        for _ in batch:
+            _log_queue.task_done()
+
+# Event worker pool: Telethon dispatches updates sequentially, so any slow
+# await inside the handler delays the next event. The registered handler only
+# enqueues; a small pool of workers drains the queue so per-message IO
+# overlaps across events. QueueFull drops are logged as backpressure.
+_event_queue: asyncio.Queue = asyncio.Queue(maxsize=1024)
+_event_workers: list = []
+_EVENT_WORKER_COUNT = 8
+
+async def _enqueue_event(event):
+    """Lightweight registered handler: hand the event to the worker pool."""
+    try:
+        _event_queue.put_nowait(event)
+    except asyncio.QueueFull:
+        logger.warning("Event queue full; dropping incoming event (backpressure).")
+
+async def _event_worker():
+    """Consumes queued events and runs the full handler on each."""
+    while True:
+        event = await _event_queue.get()
+        try:
+            await handle_new_message(event)
+        except Exception as e:
+            logger.error(f"Event worker error: {e}", exc_info=True)
+        finally:
+            _event_queue.task_done()
 
-# Helper to find links in text
+# Helper to find links in text. Compiled once at import so /query over large
+# result sets doesn't re-hit the re module's pattern cache lock per message.
 URL_REGEX = r'https?://[^\s<>\"\\\'`]+(?<![.,!?:;\"\\\'`])'
-
-async def handle_new_message(event):
-    """Handles incoming messages: logs, processes commands, forwards notifications if active."""
-    global is_forwarding_active, _BOT_USER_ID
-
-    sender = None
-    message = event.message
+URL_RE = re.compile(URL_REGEX)
+
+def _extract_links(rows) -> set:
+    """Collects links from query rows (regex over text + stored entities).
+
+    Plain synchronous CPU work, intended to run off the event loop via
+    asyncio.to_thread when the result set is large.
+    """
+    findall = URL_RE.findall
+    links = set()
+    for msg in rows:
+        text = msg.get('text')
+        if text:
+            links.update(findall(text))
+        raw_entities = msg.get('entities')
+        if raw_entities:
+            try:
+                entities_list = orjson.loads(raw_entities)
+                if isinstance(entities_list, list):
+                    for entity in entities_list:
+                        if isinstance(entity, dict):
+                            if entity.get('type') == 'url' and text:
+                                # Extract URL substring from text based on offset/length
+                                offset = entity.get('offset', 0)
+                                length = entity.get('length', 0)
+                                if length > 0:
+                                    links.add(text[offset:offset+length])
+                            elif entity.get('type') == 'text_link' and entity.get('url'):
+                                links.add(entity['url'])
+            except (orjson.JSONDecodeError, TypeError):
+                logger.warning(f"Could not parse entities JSON for link extraction: {raw_entities}")
+    return links
+
+
+# Telethon's to_dict() walks the whole TLObject reflectively; downstream code
+# only ever reads type/offset/length/url/user_id, so extract just those.
+# The short names match what the /query link extraction expects.
+_ENTITY_TYPE = {
+    MessageEntityUrl: 'url',
+    MessageEntityTextUrl: 'text_link',
+    MessageEntityMention: 'mention',
+    MessageEntityMentionName: 'text_mention',
+    MessageEntityHashtag: 'hashtag',
+    MessageEntityBotCommand: 'bot_command',
+    MessageEntityEmail: 'email',
+    MessageEntityPhone: 'phone_number',
+    MessageEntityBold: 'bold',
+    MessageEntityItalic: 'italic',
+    MessageEntityCode: 'code',
+    MessageEntityPre: 'pre',
+}
+_LINK_ENTITY_TYPES = (MessageEntityUrl, MessageEntityTextUrl)
+
+def _serialize_entities(entities):
+    """Converts raw Telethon entities to the compact dict list stored in the DB.
+
+    Runs in the background log writer (or the flat-file append), not in the
+    per-message handler, so entity-heavy messages don't pay dict-building
+    cost on the hot path.
+    """
+    if not entities:
+        return None
+    out = []
+    for entity in entities:
+        entity_type = type(entity)
+        entity_dict = {
+            'type': _ENTITY_TYPE.get(entity_type, entity_type.__name__),
+            'offset': entity.offset,
+            'length': entity.length,
+        }
+        url = getattr(entity, 'url', None)
+        if url:
+            entity_dict['url'] = url
+        user_id = getattr(entity, 'user_id', None)
+        if user_id is not None:
+            entity_dict['user_id'] = user_id
+        out.append(entity_dict)
+    return out
+
+# --- Media parsing ---
+# One handler per media class, dispatched via type(media) below. Each returns
+# a (media_type, media_info) pair; keeping them as small pure functions means
+# the hot path does a single dict lookup instead of an isinstance chain.
+
+def _media_photo(media):
+    photo = media.photo
+    # Extract basic info, avoiding full object serialization
+    return 'photo', {
+        'id': photo.id,
+        'access_hash': photo.access_hash,
+        'has_stickers': bool(photo.has_stickers),
+        # 'sizes': [s.type for s in photo.sizes] # Example: can add more if needed
+    }
+
+def _media_document(media):
+    doc = media.document
+    mime = doc.mime_type
+    attrs = doc.attributes or ()
+    # One typed scan picks up both the filename and the sticker
+    # flag; only webp documents need the sticker test at all.
+    need_sticker = mime == 'image/webp'
+    filename = None
+    is_sticker = False
+    for attr in attrs:
+        if isinstance(attr, DocumentAttributeFilename):
+            filename = attr.file_name
+            if not need_sticker or is_sticker:
+                break
+        elif need_sticker and isinstance(attr, DocumentAttributeSticker):
+            is_sticker = True
+            if filename is not None:
+                break
+    media_info = {
+        'id': doc.id,
+        'access_hash': doc.access_hash,
+        'mime_type': mime,
+        'size': doc.size,
+        'filename': filename,
+        # Add other attributes like video/audio duration if needed
+    }
+    # Refine media type based on mime type; a single prefix slice
+    # replaces two startswith calls on the common video/audio cases.
+    media_type = 'document'
+    if mime:
+        prefix = mime[:6]
+        if prefix == 'video/':
+            media_type = 'video'
+        elif prefix == 'audio/':
+            media_type = 'audio'
+        elif is_sticker: # Stickers are often webp documents
+            media_type = 'sticker'
+    return media_type, media_info
+
+def _media_webpage(media):
+    webpage = media.webpage
+    return 'webpage', {
+        'url': getattr(webpage, 'url', None),
+        'display_url': getattr(webpage, 'display_url', None),
+        'site_name': getattr(webpage, 'site_name', None),
+        'title': getattr(webpage, 'title', None),
+        # 'description': getattr(webpage, 'description', None)
+    }
+
+# Add entries for other media types (MessageMediaContact, Geo, etc.) if needed
+_MEDIA_HANDLERS = {
+    MessageMediaPhoto: _media_photo,
+    MessageMediaDocument: _media_document,
+    MessageMediaWebPage: _media_webpage,
+}
+
+# Notification header template, compiled once. format_map with a small dict
+# replaces the chain of per-message f-string concatenations; the body is
+# appended separately so it can be truncated to budget *before* the concat
+# (no multi-KB intermediate string for long messages).
+_FWD_HEADER = (
+    "✉️ Received Msg{indicator}\n"
+    "From: {chat_display} ({chat_type})\n"
+    "By: {sender_display}\n"
+    "Time: {ts}\n"
+    "Ref: {message_id} / {chat_id}\n"
+    "---\n"
+)
+_TRUNC_SUFFIX = "... (truncated)"
+_FWD_MAX_LEN = 4000  # Slightly under Telegram's hard message limit
+
+def _truncate(s: str, limit: int = _FWD_MAX_LEN) -> str:
+    """Caps a string to limit chars, appending the truncation marker.
+
+    Within-limit strings (the common case) are returned as-is with no
+    allocation; only oversized ones pay for the slice+concat.
+    """
+    if len(s) <= limit:
+        return s
+    return s[:limit] + _TRUNC_SUFFIX
+
+@functools.lru_cache(maxsize=128)
+def _fmt_ts(epoch_sec: int) -> str:
+    """Formats a unix second as the header timestamp string.
+
+    Bursts land many messages inside the same second, so the LRU makes the
+    repeat formatting a dict hit instead of a datetime round-trip.
+    """
+    return datetime.fromtimestamp(epoch_sec, tz=timezone.utc).isoformat(sep=' ', timespec='seconds')
+
+# Sender/chat entities keyed by id with a TTL, so steady-state messages skip
+# the get_sender()/get_chat() awaits (each a possible session-DB or network
+# hop). Entries expire so renames/username changes are eventually picked up.
+_ENTITY_CACHE_TTL = 300.0  # seconds
+_ENTITY_CACHE_MAX = 4096
+_sender_cache: dict[int, tuple[float, object]] = {}
+_chat_entity_cache: dict[int, tuple[float, object]] = {}
+
+def _entity_cache_get(cache: dict, key):
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    cached_at, value = entry
+    if monotonic() - cached_at > _ENTITY_CACHE_TTL:
+        del cache[key]
+        return None
+    return value
+
+def _entity_cache_put(cache: dict, key, value):
+    if key is None or value is None:
+        return
+    if len(cache) >= _ENTITY_CACHE_MAX:
+        # Drop the stalest entry to stay bounded.
+        oldest = min(cache, key=lambda k: cache[k][0])
+        del cache[oldest]
+    cache[key] = (monotonic(), value)
+
+# Command-argument resolution cache (same TTL machinery, string-keyed).
+# Operators typically repeat the same argument across commands or retries,
+# so the resolve round-trip is paid once per identifier, not per command.
+_resolve_cache: dict[str, tuple[float, object]] = {}
+
+async def _resolve(client, key):
+    """client.get_entity with a short TTL cache; used by command handlers."""
+    entity = _entity_cache_get(_resolve_cache, key)
+    if entity is None:
+        entity = await client.get_entity(key)
+        _entity_cache_put(_resolve_cache, key, entity)
+    return entity
+
+async def _resolve_target(client, args):
+    """Parses args as a numeric id, else resolves it as an entity.
+
+    Returns (target_id, entity); entity is None when args was numeric.
+    Shared by the remove-style commands that accept either form.
+    """
     try:
-        sender = await event.get_sender()
-        sender_id = getattr(sender, 'id', None)
-        sender_username = getattr(sender, 'username', None)
-        sender_first_name = getattr(sender, 'first_name', None)
-        sender_last_name = getattr(sender, 'last_name', None)
-        sender_is_bot = getattr(sender, 'bot', False)
-
-        # 2. Get Chat Info (for logging)
-        chat = await event.get_chat()
-        chat_id = event.chat_id
-        chat_title = getattr(chat, 'title', None) # Title for groups/channels
-        chat_username = getattr(chat, 'username', None)
+        return int(args), None
+    except ValueError:
+        entity = await _resolve(client, args)
+        target_id = getattr(entity, 'id', None) or getattr(entity, 'user_id', None)
+        return target_id, entity
+
+# Configured-group ids persisted across restarts. Telethon's session cache
+# usually covers these, but a fresh/trimmed session pays one ResolveUsername
+# RPC per group at startup; the JSON file makes cold starts ~free.
+_ENTITY_ID_CACHE_PATH = os.path.join("sessions", "entity_cache.json")
+
+def _load_entity_ids() -> dict:
+    """Loads the persisted identifier -> entity id map (empty on any error)."""
+    try:
+        with open(_ENTITY_ID_CACHE_PATH, 'rb') as f:
+            return {str(k): int(v) for k, v in orjson.loads(f.read()).items()}
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.warning(f"Could not load entity id cache: {e}")
+        return {}
 
-        # Determine chat type (for logging)
-        if isinstance(event.peer_id, PeerUser):
-            chat_type = 'user'
-            # For DMs, use sender's name as title if chat title is None
-            if not chat_title and sender:
-                 chat_title = f"{sender_first_name or ''} {sender_last_name or ''}".strip()
-        elif isinstance(event.peer_id, PeerChat):
-            chat_type = 'group' # Legacy group
-        elif isinstance(event.peer_id, PeerChannel):
-            # Could be supergroup or channel - check 'broadcast' flag
-            chat_type = 'channel' if getattr(chat, 'broadcast', False) else 'group'
+def _save_entity_ids(mapping: dict):
+    """Atomically persists the identifier -> entity id map."""
+    tmp_path = _ENTITY_ID_CACHE_PATH + ".tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(orjson.dumps(mapping))
+        os.replace(tmp_path, _ENTITY_ID_CACHE_PATH)
+    except Exception as e:
+        logger.warning(f"Could not save entity id cache: {e}")
+
+# Display strings are stable per sender/chat but were rebuilt (with several
+# string allocations) for every notification. lru_cache keys on the full
+# field tuple, so the C-level hit path skips the string work entirely while
+# renames/username changes naturally miss into a fresh entry.
+
+@functools.lru_cache(maxsize=4096)
+def _sender_display_for(sender_id, first_name, last_name, username, is_bot) -> str:
+    if sender_id is None:
+        return "(Unknown Sender)"
+    display = (f"{first_name or ''} {last_name or ''}".strip()
+               or username
+               or f"ID:{sender_id}")
+    if is_bot:
+        display += " [Bot]"
+    return display
+
+@functools.lru_cache(maxsize=4096)
+def _chat_display_for(chat_id, title, username) -> str:
+    return title or username or f"ID:{chat_id}"
+
+# Resolved InputPeer per notification target. Passing a raw int ID to
+# send_message makes Telethon re-resolve the entity on every call; resolving
+# once per target and reusing the InputPeer removes that per-send overhead.
+_input_peer_cache: dict[int, object] = {}
+
+async def _get_input_peer(client, target_id: int):
+    """Returns a cached InputPeer for the target, resolving once on miss."""
+    peer = _input_peer_cache.get(target_id)
+    if peer is None:
+        peer = await client.get_input_entity(target_id)
+        _input_peer_cache[target_id] = peer
+    return peer
+
+# Notification coalescing: bursts of messages are joined into one digest per
+# send window, cutting outbound API calls (and FloodWait risk) on busy chats.
+# A lone message on an idle queue is sent immediately to keep latency low.
+_notify_queue: asyncio.Queue = asyncio.Queue(maxsize=10_000)
+_notify_worker_task: asyncio.Task | None = None
+_NOTIFY_SEP = "\n\n───\n\n"
+_NOTIFY_MAX_CHARS = 3500
+_NOTIFY_WINDOW = 0.25  # seconds to collect more messages into one digest
+
+async def _notify_worker():
+    """Drains the notification queue, coalescing bursts into digest sends."""
+    loop = asyncio.get_running_loop()
+    pending = None  # Item that overflowed the previous digest's char budget
+    while True:
+        if pending is not None:
+            text, chat_id, message_id = pending
+            pending = None
         else:
-            chat_type = 'unknown'
-
-        # 3. Get Message Info (including entities and media)
-        message_id = message.id
-        timestamp = message.date # Already a datetime object
-        text = message.text # Or message.message
-        entities = message.entities # Can be None
-        media = message.media
-
-        # Process media information
-        media_type = None
-        media_info = None
-        if isinstance(media, MessageMediaPhoto):
-            media_type = 'photo'
-            # Extract basic info, avoiding full object serialization
-            media_info = {
-                'id': media.photo.id,
-                'access_hash': media.photo.access_hash,
-                'has_stickers': bool(media.photo.has_stickers),
-                # 'sizes': [s.type for s in media.photo.sizes] # Example: can add more if needed
-            }
-        elif isinstance(media, MessageMediaDocument):
-            media_type = 'document'
-            doc_attrs = {attr.CONSTRUCTOR_ID: attr for attr in media.document.attributes}
-            filename_attr = doc_attrs.get(b'\x15\xb2\x9d\x28') # DocumentAttributeFilename
-            media_info = {
-                'id': media.document.id,
-                'access_hash': media.document.access_hash,
-                'mime_type': media.document.mime_type,
-                'size': media.document.size,
-                'filename': getattr(filename_attr, 'file_name', None),
-                # Add other attributes like video/audio duration if needed
-            }
-            # Refine media type based on mime type
-            if media.document.mime_type:
-                if media.document.mime_type.startswith('video/'):
-                    media_type = 'video'
-                elif media.document.mime_type.startswith('audio/'):
-                    media_type = 'audio'
-                elif media.document.mime_type == 'image/webp': # Stickers are often webp documents
-                     # Check for DocumentAttributeSticker
-                     if b'\xaf\`\xf5\x06' in doc_attrs:
-                         media_type = 'sticker'
-        elif isinstance(media, MessageMediaWebPage):
-            media_type = 'webpage'
-            media_info = {
-                'url': getattr(media.webpage, 'url', None),
-                'display_url': getattr(media.webpage, 'display_url', None),
-                'site_name': getattr(media.webpage, 'site_name', None),
-                'title': getattr(media.webpage, 'title', None),
-                # 'description': getattr(media.webpage, 'description', None)
-            }
-        # Add elif blocks for other media types (MessageMediaContact, Geo, etc.) if needed
-
-        # Convert Telethon entities to simpler list of dicts for JSON serialization
-        serializable_entities = None
-        if entities:
-            serializable_entities = []
-            for entity in entities:
+            text, chat_id, message_id = await _notify_queue.get()
+        parts = [text]
+        refs = [(chat_id, message_id)]
+        total = len(text)
+        if not _notify_queue.empty():
+            deadline = loop.time() + _NOTIFY_WINDOW
+            while True:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
                 try:
-                    # Use to_dict() and remove internal '_' key
-                    entity_dict = entity.to_dict()
-                    entity_dict.pop('_', None)
-                    serializable_entities.append(entity_dict)
-                except Exception as e:
-                    logger.warning(f"Failed to serialize entity {type(entity)}: {e}")
-                    # Append a placeholder or skip
-                    serializable_entities.append({'type': 'serialization_error', 'repr': repr(entity)})
-
-        # Basic console logging (optional, can be removed later)
-        logger.info(
-            f"New message in {chat_type} '{chat_title or chat_username}' (ID: {chat_id}) "
-            f"from user '{sender_username or sender_id}' (ID: {sender_id}): "
-            f"MsgID {message_id}"
+                    n_text, n_chat, n_msg = await asyncio.wait_for(_notify_queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if total + len(_NOTIFY_SEP) + len(n_text) > _NOTIFY_MAX_CHARS:
+                    # Doesn't fit: carry it into the next digest rather than
+                    # letting _truncate silently drop its content after it has
+                    # already been marked forwarded.
+                    pending = (n_text, n_chat, n_msg)
+                    break
+                parts.append(n_text)
+                refs.append((n_chat, n_msg))
+                total += len(n_text) + len(_NOTIFY_SEP)
+        # Collected parts always fit the budget; this only caps an oversized
+        # single message.
+        digest = _truncate(_NOTIFY_SEP.join(parts))
+        try:
+            await _deliver_notifications(_client, digest, refs)
+        except Exception as e:
+            logger.error(f"Notification worker failed to deliver digest of {len(refs)}: {e}", exc_info=True)
+
+async def _deliver_notifications(client, digest, refs):
+    """Sends a digest to all targets and marks the covered messages forwarded."""
+    target_ids = _notify_target_ids
+    if not target_ids:
+        # Cold cache (or genuinely empty table — owner should always exist).
+        await _reload_notify_targets()
+        target_ids = _notify_target_ids
+    if not target_ids:
+        logger.warning("No notification targets found (owner missing?). Skipping send.")
+        return
+
+    # Skip targets still under a flood-wait penalty; one rate-limited user
+    # must not cost the others their digest.
+    now = monotonic()
+    sendable = [tid for tid in target_ids if _flood_until.get(tid, 0.0) <= now]
+    if not sendable:
+        logger.warning("All notification targets are flood-limited; digest skipped.")
+        return
+
+    async def _send_one(target_id):
+        return await client.send_message(
+            entity=await _get_input_peer(client, target_id),
+            message=digest,
+            link_preview=False
         )
 
-        # --- Command Processing --- (Only if message is from the OWNER user)
-        if sender_id == OWNER_USER_ID:
-            parts = text.strip().split(maxsplit=1) if text else []
-            command = parts[0].lower() if parts else ""
-            args = parts[1] if len(parts) > 1 else ""
-
-            if command == '/stop_forwarding':
-                if is_forwarding_active:
-                    is_forwarding_active = False
-                    await event.reply("OK. Message notifications stopped.")
-                    logger.info(f"Forwarding stopped by user {OWNER_USER_ID}.")
-                else:
-                    await event.reply("Notifications are already stopped.")
-                return # Stop processing after handling command
-
-            elif command == '/start_forwarding':
-                if not is_forwarding_active:
-                    is_forwarding_active = True
-                    logger.info(f"Forwarding started by user {OWNER_USER_ID}.")
-                    # Get summary of missed messages
-                    summary_data = await get_unforwarded_summary()
-                    if summary_data:
-                        summary_lines = ["Missed message summary:"]
-                        for chat, count in summary_data.items():
-                            summary_lines.append(f"- {chat}: {count} unread")
-                        summary_text = "\n".join(summary_lines)
-                    else:
-                        summary_text = "No unread messages found since forwarding stopped."
-                    await event.reply(f"OK. Message notifications started.\n\n{summary_text}")
-                else:
-                    await event.reply("Notifications are already active.")
-                return # Stop processing after handling command
-
-            elif command == '/summary_today':
-                 await event.reply("Generating today's summary from AI... please wait.")
-                 logger.info(f"Summary requested by user {OWNER_USER_ID}.")
-                 # Calculate start of today in UTC
-                 today_utc = datetime.now(timezone.utc).date()
-                 today_start = datetime.combine(today_utc, time.min, tzinfo=timezone.utc)
-
-                 logger.debug(f"Querying messages for summary since: {today_start}")
-                 # Use get_messages_since with today's start time
-                 messages_to_summarize = await get_messages_since(today_start)
-
-                 client_config = getattr(event.client, 'app_config', None)
-                 if client_config:
-                     ai_summary = await get_ai_summary(client_config, messages_to_summarize)
-                     if ai_summary and not ai_summary.startswith(("Error", "AI summarization not configured", "No new messages")):
-                         await event.reply(f"AI Summary for Today:\n---\n{ai_summary}")
-                     else:
-                         await event.reply(f"Could not generate AI summary: {ai_summary or 'Unknown error'}") # Show reason
-                 else:
-                     await event.reply("Error: Could not access bot configuration for AI settings.")
-                 return # Stop processing after handling command
-
-            # --- New Monitor Commands ---
-            elif command == '/monitor_add':
-                if not args:
-                    await event.reply("Usage: /monitor_add <chat_id or username/link>")
-                    return
-                try:
-                    target_chat = await event.client.get_entity(args)
-                    await add_monitored_chat(target_chat.id, getattr(target_chat, 'title', None), getattr(target_chat, 'username', None))
-                    await event.reply(f"OK. Added chat '{getattr(target_chat, 'title', args)}' (ID: {target_chat.id}) to monitor list.")
-                except ValueError:
-                    await event.reply(f"Error: Could not find chat '{args}'. Please provide a valid ID, username, or link.")
-                except Exception as e:
-                    await event.reply(f"Error adding chat: {e}")
-                    logger.error(f"Error in /monitor_add: {e}", exc_info=True)
-                return
+    async def _retry_after_flood(target_id, seconds):
+        # Retried off-path so one rate-limited target doesn't stall the
+        # fan-out (or the next digest) for everyone else.
+        await asyncio.sleep(seconds + 1)
+        try:
+            await _send_one(target_id)
+        except Exception as e:
+            logger.error(f"Flood-wait retry to target {target_id} failed: {e}")
 
-            elif command == '/monitor_remove':
-                if not args:
-                    await event.reply("Usage: /monitor_remove <chat_id or username/link>")
-                    return
-                try:
-                    # Try resolving as int first, then as entity
-                    try:
-                        chat_id_to_remove = int(args)
-                        removed = await remove_monitored_chat(chat_id_to_remove)
-                    except ValueError:
-                        target_chat = await event.client.get_entity(args)
-                        removed = await remove_monitored_chat(target_chat.id)
-
-                    if removed:
-                        await event.reply(f"OK. Removed chat '{args}' from monitor list.")
-                    else:
-                        await event.reply(f"Chat '{args}' was not found in the monitor list.")
-                except ValueError:
-                     await event.reply(f"Error: Could not find chat '{args}'. Please provide a valid ID, username, or link.")
-                except Exception as e:
-                    await event.reply(f"Error removing chat: {e}")
-                    logger.error(f"Error in /monitor_remove: {e}", exc_info=True)
-                return
+    async with _fwd_sem:
+        # Dispatch all target sends concurrently: total latency is one
+        # round-trip instead of one per target.
+        results = await asyncio.gather(
+            *[_send_one(tid) for tid in sendable], return_exceptions=True
+        )
+        successful_sends = 0
+        for target_id, result in zip(sendable, results):
+            if isinstance(result, UserIsBlockedError):
+                logger.warning(f"Cannot send notification to {target_id}: User has blocked.")
+            elif isinstance(result, FloodWaitError):
+                # Record the deadline so later digests skip this target
+                # outright instead of re-triggering the flood error.
+                _flood_until[target_id] = monotonic() + result.seconds + 1
+                logger.warning(f"Flood wait sending notification to {target_id}. Retrying in {result.seconds}s.")
+                retry = asyncio.create_task(_retry_after_flood(target_id, result.seconds))
+                _bg_tasks.add(retry)
+                retry.add_done_callback(_bg_tasks.discard)
+            elif isinstance(result, BaseException):
+                logger.error(f"Failed to send notification digest to target {target_id}: {result}")
+            else:
+                successful_sends += 1
+
+        if successful_sends > 0:
+            logger.info("Notification digest (%d message(s)) sent to %d/%d targets.",
+                        len(refs), successful_sends, len(sendable))
+            # Mark messages as forwarded only if sent to at least one target.
+            # The DB mark doesn't gate delivery, so run it detached rather
+            # than making the next digest wait on per-row UPDATEs.
+            mark = asyncio.create_task(_mark_refs_forwarded(refs))
+            _bg_tasks.add(mark)
+            mark.add_done_callback(_bg_tasks.discard)
+        else:
+            logger.warning(f"Notification digest ({len(refs)} message(s)) failed for all targets.")
 
-            elif command == '/monitor_list':
-                monitored = await list_monitored_chats()
-                if monitored:
-                    lines = ["Currently Monitored Chats:"]
-                    for chat in monitored:
-                        display = chat['title'] or chat['username'] or f"ID:{chat['chat_id']}"
-                        lines.append(f"- {display} (ID: {chat['chat_id']})")
-                    await event.reply("\n".join(lines))
-                else:
-                    await event.reply("No chats are specifically monitored. All incoming messages are processed.")
-                return
+async def _mark_refs_forwarded(refs):
+    """Marks a digest's messages forwarded in the DB (detached from delivery)."""
+    try:
+        await mark_messages_forwarded_bulk(refs)
+    except Exception as e:
+        logger.error(f"Failed to mark {len(refs)} message(s) forwarded: {e}")
+
+# --- Owner command handlers ---
+# Each command is its own coroutine; dispatch below is one dict lookup
+# instead of a 12-branch if/elif walk per command message.
+
+# Bound the AI fan-out: at most two in-flight completions, each capped at
+# 60 s, so a burst of /summary_today or /query can neither stack up
+# long-running requests nor hang a handler on a stalled endpoint.
+_AI_SEM = asyncio.Semaphore(2)
+_AI_TIMEOUT = 60.0  # seconds per AI call
+
+async def _cmd_stop_forwarding(event, args):
+    """Pauses all notification sends."""
+    if _state.forwarding:
+        _state.forwarding = False
+        await event.reply("OK. Message notifications stopped.")
+        logger.info(f"Forwarding stopped by user {OWNER_USER_ID}.")
+    else:
+        await event.reply("Notifications are already stopped.")
+    return # Stop processing after handling command
+
+async def _cmd_start_forwarding(event, args):
+    """Resumes notifications and reports what was missed."""
+    if not _state.forwarding:
+        _state.forwarding = True
+        logger.info(f"Forwarding started by user {OWNER_USER_ID}.")
+        # Get summary of missed messages
+        summary_data = await get_unforwarded_summary()
+        if summary_data:
+            summary_lines = ["Missed message summary:"]
+            for chat, count in summary_data.items():
+                summary_lines.append(f"- {chat}: {count} unread")
+            summary_text = "\n".join(summary_lines)
+        else:
+            summary_text = "No unread messages found since forwarding stopped."
+        await event.reply(f"OK. Message notifications started.\n\n{summary_text}")
+    else:
+        await event.reply("Notifications are already active.")
+    return # Stop processing after handling command
+
+async def _cmd_summary_today(event, args):
+    """Generates an AI summary of today's messages."""
+    await event.reply("Generating today's summary from AI... please wait.")
+    logger.info(f"Summary requested by user {OWNER_USER_ID}.")
+    # Calculate start of today in UTC
+    today_utc = datetime.now(timezone.utc).date()
+    today_start = datetime.combine(today_utc, time.min, tzinfo=timezone.utc)
+
+    logger.debug("Querying messages for summary since: %s", today_start)
+    # Use get_messages_since with today's start time
+    messages_to_summarize = await get_messages_since(today_start)
+
+    client_config = getattr(event.client, 'app_config', None)
+    if client_config:
+        try:
+            async with _AI_SEM:
+                ai_summary = await asyncio.wait_for(
+                    get_ai_summary(client_config, messages_to_summarize), _AI_TIMEOUT)
+        except asyncio.TimeoutError:
+            await event.reply(f"AI summary timed out after {_AI_TIMEOUT:.0f}s. Please try again.")
+            return
+        if ai_summary and not ai_summary.startswith(("Error", "AI summarization not configured", "No new messages")):
+            await event.reply(f"AI Summary for Today:\n---\n{ai_summary}")
+        else:
+            await event.reply(f"Could not generate AI summary: {ai_summary or 'Unknown error'}") # Show reason
+    else:
+        await event.reply("Error: Could not access bot configuration for AI settings.")
+    return # Stop processing after handling command
 
-            # --- New Clear Command ---
-            elif command == '/monitor_clear':
-                deleted_count = await clear_monitored_chats()
-                if deleted_count >= 0:
-                    await event.reply(f"OK. Cleared {deleted_count} monitored chats. Now monitoring all chats.")
-                else:
-                    await event.reply("Error clearing monitored chats list.")
-                return
+# --- New Monitor Commands ---
 
-            # --- New Query Command ---
-            elif command == '/query':
-                if not args:
-                    await event.reply("Usage: /query <your natural language query about messages>\nExample: /query show me links from 'Test Group' today")
-                    return
+async def _cmd_monitor_add(event, args):
+    """Adds a chat to the monitor list."""
+    if not args:
+        await event.reply("Usage: /monitor_add <chat_id or username/link>")
+        return
+    try:
+        target_chat = await _resolve(event.client, args)
+        await add_monitored_chat(target_chat.id, getattr(target_chat, 'title', None), getattr(target_chat, 'username', None))
+        await _reload_monitored()
+        await event.reply(f"OK. Added chat '{getattr(target_chat, 'title', args)}' (ID: {target_chat.id}) to monitor list.")
+    except ValueError:
+        await event.reply(f"Error: Could not find chat '{args}'. Please provide a valid ID, username, or link.")
+    except Exception as e:
+        await event.reply(f"Error adding chat: {e}")
+        logger.error(f"Error in /monitor_add: {e}", exc_info=True)
+    return
+
+async def _cmd_monitor_remove(event, args):
+    """Removes a chat from the monitor list."""
+    if not args:
+        await event.reply("Usage: /monitor_remove <chat_id or username/link>")
+        return
+    try:
+        chat_id_to_remove, _ = await _resolve_target(event.client, args)
+        removed = await remove_monitored_chat(chat_id_to_remove)
 
-                nlp_query_text = args
-                await event.reply(f"Processing query: '{nlp_query_text}'\nExtracting parameters using AI...")
+        if removed:
+            await _reload_monitored()
+            await event.reply(f"OK. Removed chat '{args}' from monitor list.")
+        else:
+            await event.reply(f"Chat '{args}' was not found in the monitor list.")
+    except ValueError:
+         await event.reply(f"Error: Could not find chat '{args}'. Please provide a valid ID, username, or link.")
+    except Exception as e:
+        await event.reply(f"Error removing chat: {e}")
+        logger.error(f"Error in /monitor_remove: {e}", exc_info=True)
+    return
+
+async def _cmd_monitor_list(event, args):
+    """Lists the currently monitored chats."""
+    monitored = await list_monitored_chats()
+    if monitored:
+        lines = ["Currently Monitored Chats:"]
+        for chat in monitored:
+            display = chat['title'] or chat['username'] or f"ID:{chat['chat_id']}"
+            lines.append(f"- {display} (ID: {chat['chat_id']})")
+        await event.reply("\n".join(lines))
+    else:
+        await event.reply("No chats are specifically monitored. All incoming messages are processed.")
+    return
 
-                client_config = getattr(event.client, 'app_config', None)
-                if not client_config or not client_config.ai_api_base or not client_config.ai_api_key:
-                     await event.reply("Error: AI is not configured. Cannot process NLP query.")
-                     return
+# --- New Clear Command ---
 
-                # Call AI to extract parameters
-                extracted_params = await extract_query_params_from_nlp(client_config, nlp_query_text)
+async def _cmd_monitor_clear(event, args):
+    """Clears the monitor list (monitor everything again)."""
+    deleted_count = await clear_monitored_chats()
+    await _reload_monitored()
+    if deleted_count >= 0:
+        await event.reply(f"OK. Cleared {deleted_count} monitored chats. Now monitoring all chats.")
+    else:
+        await event.reply("Error clearing monitored chats list.")
+    return
 
-                if extracted_params is None: # Indicates AI call failed
-                    await event.reply("Error: Failed to call AI for parameter extraction.")
-                    return
-                if not extracted_params: # Indicates AI could not understand query
-                    await event.reply("Sorry, I couldn't understand that query or map it to filters. Please try rephrasing.")
-                    return
+# --- New Query Command ---
 
-                await event.reply(f"AI Extracted Filters: `{json.dumps(extracted_params)}`\nQuerying database...")
+async def _cmd_query(event, args):
+    """Answers a natural-language query over the logged messages."""
+    if not args:
+        await event.reply("Usage: /query <your natural language query about messages>\nExample: /query show me links from 'Test Group' today")
+        return
 
-                # Call the database query function
-                query_results = await query_messages(**extracted_params) # Pass extracted params as kwargs
+    nlp_query_text = args
+    await event.reply(f"Processing query: '{nlp_query_text}'\nExtracting parameters using AI...")
 
-                if not query_results:
-                    await event.reply("No messages found matching your query.")
-                    return
+    client_config = getattr(event.client, 'app_config', None)
+    if not client_config or not client_config.ai_api_base or not client_config.ai_api_key:
+         await event.reply("Error: AI is not configured. Cannot process NLP query.")
+         return
 
-                # Process results
-                response_lines = [f"Query Results ({len(query_results)}):\n---"]
-                output_links_only = extracted_params.get('content_filter', '').lower() == 'links'
-                links_found = set()
-
-                for msg in query_results:
-                    if output_links_only:
-                        # Extract links from text using regex
-                        if msg.get('text'):
-                             links_found.update(re.findall(URL_REGEX, msg['text']))
-                        # Extract links from entities
-                        if msg.get('entities'):
-                            try:
-                                entities_list = json.loads(msg['entities'])
-                                if isinstance(entities_list, list):
-                                    for entity in entities_list:
-                                        if isinstance(entity, dict):
-                                            if entity.get('type') == 'url' and msg.get('text'):
-                                                # Extract URL substring from text based on offset/length
-                                                offset = entity.get('offset', 0)
-                                                length = entity.get('length', 0)
-                                                if length > 0:
-                                                     links_found.add(msg['text'][offset:offset+length])
-                                            elif entity.get('type') == 'text_link' and entity.get('url'):
-                                                links_found.add(entity['url'])
-                            except (json.JSONDecodeError, TypeError):
-                                logger.warning(f"Could not parse entities JSON for link extraction: {msg.get('entities')}")
-                    else:
-                        # Format full message info
-                        ts = msg.get('timestamp', 'Unknown Time')
-                        # Convert from string if needed (assuming query returns string)
-                        if isinstance(ts, str): ts = datetime.fromisoformat(ts.replace('Z', '+00:00'))
-                        ts_str = ts.strftime('%Y-%m-%d %H:%M') if isinstance(ts, datetime) else str(ts)
-                        sender = msg.get('sender_username', f"ID:{msg.get('sender_id', '?')}")
-                        chat = msg.get('chat_title', f"ID:{msg.get('chat_id', '?')}")
-                        text = msg.get('text', '')
-                        media = f" [Media: {msg.get('media_type')}]" if msg.get('media_type') else ""
-                        response_lines.append(f"[{ts_str}] ({chat} by {sender}): {text}{media}")
-
-                # Construct final reply
-                if output_links_only:
-                    if links_found:
-                        response_lines.append("Found Links:")
-                        response_lines.extend(list(links_found))
-                    else:
-                        response_lines.append("No links found in the matching messages.")
-
-                # Send potentially long messages in chunks
-                full_response = "\n".join(response_lines)
-                max_len = 4000 # Telegram message limit
-                for i in range(0, len(full_response), max_len):
-                    chunk = full_response[i:i+max_len]
-                    await event.reply(chunk)
-
-                return # Stop processing after handling query
-
-            # --- New Help Command ---
-            elif command == '/help':
-                help_text = """**Available Commands (Owner Only):**
+    # Call AI to extract parameters
+    try:
+        async with _AI_SEM:
+            extracted_params = await asyncio.wait_for(
+                extract_query_params_from_nlp(client_config, nlp_query_text), _AI_TIMEOUT)
+    except asyncio.TimeoutError:
+        await event.reply(f"AI parameter extraction timed out after {_AI_TIMEOUT:.0f}s. Please try again.")
+        return
+
+    if extracted_params is None: # Indicates AI call failed
+        await event.reply("Error: Failed to call AI for parameter extraction.")
+        return
+    if not extracted_params: # Indicates AI could not understand query
+        await event.reply("Sorry, I couldn't understand that query or map it to filters. Please try rephrasing.")
+        return
+
+    await event.reply(f"AI Extracted Filters: `{json.dumps(extracted_params)}`\nQuerying database...")
+
+    # Call the database query function
+    query_results = await query_messages(**extracted_params) # Pass extracted params as kwargs
+
+    if not query_results:
+        await event.reply("No messages found matching your query.")
+        return
+
+    # Process results
+    response_lines = [f"Query Results ({len(query_results)}):\n---"]
+    output_links_only = extracted_params.get('content_filter', '').lower() == 'links'
+    links_found = set()
+
+    if output_links_only:
+        # Pure-CPU scan over potentially thousands of rows; run it on a
+        # worker thread so a big result set doesn't stall the event loop
+        # (and every other handler) for its duration.
+        links_found = await asyncio.to_thread(_extract_links, query_results)
+    else:
+        for msg in query_results:
+            # Format full message info
+            ts = msg.get('timestamp', 'Unknown Time')
+            # Stored ISO timestamps are fixed-layout, so the minute-precision
+            # display string is just the first 16 chars — no per-row
+            # fromisoformat + strftime round-trip over the result set.
+            if isinstance(ts, str) and len(ts) >= 16:
+                ts_str = ts[:16].replace('T', ' ')
+            elif isinstance(ts, datetime):
+                ts_str = ts.strftime('%Y-%m-%d %H:%M')
+            else:
+                ts_str = str(ts)
+            sender = msg.get('sender_username', f"ID:{msg.get('sender_id', '?')}")
+            chat = msg.get('chat_title', f"ID:{msg.get('chat_id', '?')}")
+            text = msg.get('text', '')
+            media = f" [Media: {msg.get('media_type')}]" if msg.get('media_type') else ""
+            response_lines.append(f"[{ts_str}] ({chat} by {sender}): {text}{media}")
+
+    # Construct final reply
+    if output_links_only:
+        if links_found:
+            response_lines.append("Found Links:")
+            response_lines.extend(list(links_found))
+        else:
+            response_lines.append("No links found in the matching messages.")
+
+    # Stream the reply in chunks: flush the running buffer as soon as the
+    # next line would overflow, instead of materializing the whole response
+    # just to slice it. Peak memory stays ~one chunk and the first chunk
+    # reaches the user while the rest is still being formatted.
+    max_len = 4000 # Telegram message limit
+    buf = []
+    size = 0
+    for line in response_lines:
+        line_len = len(line) + 1  # +1 for the joining newline
+        if size and size + line_len > max_len:
+            await event.reply("\n".join(buf))
+            buf.clear()
+            size = 0
+        if line_len > max_len:
+            # A single oversized line still has to be hard-split.
+            for i in range(0, len(line), max_len):
+                await event.reply(line[i:i+max_len])
+            continue
+        buf.append(line)
+        size += line_len
+    if buf:
+        await event.reply("\n".join(buf))
+
+    return # Stop processing after handling query
+
+# --- New Help Command ---
+
+# Built once at import; the /help handler used to rebuild this 30-line
+# literal on every invocation.
+_HELP_TEXT = """**Available Commands (Owner Only):**
 
 **Notifications:**
 `/stop_forwarding` - Pause sending all notifications.
@@ -372,212 +905,391 @@ async def handle_new_message(event):
 **Help:**
 `/help` - Show this help message.
 """
-                await event.reply(help_text, parse_mode='md')
-                return
 
-            # --- New Notify Commands ---
-            elif command == '/notify_add':
-                if not args:
-                    await event.reply("Usage: /notify_add <user_id or username>")
-                    return
-                try:
-                    target_user = await event.client.get_entity(args)
-                    # Check if it's a user
-                    if not isinstance(target_user, (PeerUser, User)) and not getattr(target_user, 'user_id', None):
-                         # Try resolving ID directly if get_entity gave channel/chat
-                         try:
-                             target_id_int = int(args)
-                             target_user = await event.client.get_entity(PeerUser(target_id_int))
-                         except (ValueError, TypeError):
-                             target_user = None # Could not resolve as user
-
-                         if not target_user:
-                             await event.reply("Error: Please provide a valid user ID or username.")
-                             return
-
-                    user_id = target_user.id if hasattr(target_user, 'id') else getattr(target_user, 'user_id', None)
-                    username = getattr(target_user, 'username', None)
-                    first_name = getattr(target_user, 'first_name', None)
-
-                    if not user_id:
-                        await event.reply("Error: Could not determine User ID.")
-                        return
-
-                    success = await add_notification_target(user_id, username, first_name)
-                    if success:
-                         await event.reply(f"OK. Added notification target: {first_name or username or user_id} (ID: {user_id})")
-                    else:
-                         # Check if it failed because it was the owner
-                         if user_id == OWNER_USER_ID:
-                              await event.reply("Owner is already a notification target.")
-                         else:
-                              await event.reply(f"Failed to add target {user_id}. It might already be added or an error occurred.")
-                except ValueError:
-                    await event.reply(f"Error: Could not find user '{args}'. Please provide a valid user ID or username.")
-                except UserIsBlockedError:
-                    await event.reply(f"Error: Cannot interact with blocked user '{args}'.") # More specific error
-                except Exception as e:
-                    await event.reply(f"Error adding notification target: {e}")
-                    logger.error(f"Error in /notify_add for '{args}': {e}", exc_info=True)
-                return
+async def _cmd_help(event, args):
+    """Shows the command reference."""
+    await event.reply(_HELP_TEXT, parse_mode='md')
+    return
 
-            elif command == '/notify_remove':
-                if not args:
-                    await event.reply("Usage: /notify_remove <user_id or username>")
-                    return
-                try:
-                    # Try resolving as int first, then as entity
-                    try:
-                        target_id = int(args)
-                    except ValueError:
-                        target_user = await event.client.get_entity(args)
-                        target_id = getattr(target_user, 'id', None) or getattr(target_user, 'user_id', None)
-                        if not target_id:
-                            await event.reply("Error: Could not determine User ID from the provided argument.")
-                            return
-
-                    success = await remove_notification_target(target_id)
-                    if success:
-                        await event.reply(f"OK. Removed notification target: {args}")
-                    else:
-                        if target_id == OWNER_USER_ID:
-                            await event.reply("Cannot remove the owner from notification targets.")
-                        else:
-                            await event.reply(f"Could not remove target {args}. Ensure it exists and is not the owner.")
-                except ValueError:
-                     await event.reply(f"Error: Could not find user '{args}'. Please provide a valid user ID or username.")
-                except Exception as e:
-                    await event.reply(f"Error removing notification target: {e}")
-                    logger.error(f"Error in /notify_remove for '{args}': {e}", exc_info=True)
-                return
+# --- New Notify Commands ---
 
-            elif command == '/notify_list':
-                targets = await list_notification_targets()
-                if targets:
-                    lines = ["Current Notification Targets:"]
-                    for target in targets:
-                        display = target['first_name'] or target['username'] or f"ID:{target['user_id']}"
-                        if target['is_owner']: display += " (Owner)"
-                        lines.append(f"- {display} (ID: {target['user_id']})")
-                    await event.reply("\n".join(lines))
-                else:
-                    await event.reply("Error: Could not retrieve notification targets (owner should always be present).")
-                return
-            # ---------------------------
-        # --- End Command Processing ---
-
-        # --- Monitoring Check ---
-        should_process = True
-        any_monitored = await is_any_chat_monitored()
-        # DEBUG LOG
-        # logger.debug(f"[Msg {message_id}/{chat_id}] is_any_chat_monitored: {any_monitored}")
-        if any_monitored:
-             is_monitored = await is_chat_monitored(chat_id)
-             # DEBUG LOG
-             # logger.debug(f"[Msg {message_id}/{chat_id}] is_chat_monitored({chat_id}): {is_monitored}")
-             if not is_monitored:
-                 should_process = False
-
-        if not should_process:
-            # DEBUG LOG
-            # logger.debug(f"[Msg {message_id}/{chat_id}] Skipping processing due to monitor list.")
+async def _cmd_notify_add(event, args):
+    """Adds a user to the notification targets."""
+    if not args:
+        await event.reply("Usage: /notify_add <user_id or username>")
+        return
+    try:
+        target_user = await _resolve(event.client, args)
+        # Check if it's a user
+        if not isinstance(target_user, (PeerUser, User)) and not getattr(target_user, 'user_id', None):
+             # Try resolving ID directly if get_entity gave channel/chat
+             try:
+                 target_id_int = int(args)
+                 target_user = await event.client.get_entity(PeerUser(target_id_int))
+             except (ValueError, TypeError):
+                 target_user = None # Could not resolve as user
+
+             if not target_user:
+                 await event.reply("Error: Please provide a valid user ID or username.")
+                 return
+
+        user_id = target_user.id if hasattr(target_user, 'id') else getattr(target_user, 'user_id', None)
+        username = getattr(target_user, 'username', None)
+        first_name = getattr(target_user, 'first_name', None)
+
+        if not user_id:
+            await event.reply("Error: Could not determine User ID.")
             return
-        # -----------------------
 
-        # --- Prevent self-processing ---
-        if _BOT_USER_ID is not None and sender_id == _BOT_USER_ID:
-            logger.debug(f"[Msg {message_id}/{chat_id}] Ignoring self-sent message.")
+        success = await add_notification_target(user_id, username, first_name)
+        if success:
+             await _reload_notify_targets()
+             await event.reply(f"OK. Added notification target: {first_name or username or user_id} (ID: {user_id})")
+        else:
+             # Check if it failed because it was the owner
+             if user_id == OWNER_USER_ID:
+                  await event.reply("Owner is already a notification target.")
+             else:
+                  await event.reply(f"Failed to add target {user_id}. It might already be added or an error occurred.")
+    except ValueError:
+        await event.reply(f"Error: Could not find user '{args}'. Please provide a valid user ID or username.")
+    except UserIsBlockedError:
+        await event.reply(f"Error: Cannot interact with blocked user '{args}'.") # More specific error
+    except Exception as e:
+        await event.reply(f"Error adding notification target: {e}")
+        logger.error(f"Error in /notify_add for '{args}': {e}", exc_info=True)
+    return
+
+async def _cmd_notify_remove(event, args):
+    """Removes a user from the notification targets."""
+    if not args:
+        await event.reply("Usage: /notify_remove <user_id or username>")
+        return
+    try:
+        target_id, _ = await _resolve_target(event.client, args)
+        if not target_id:
+            await event.reply("Error: Could not determine User ID from the provided argument.")
             return
 
-        # --- Regular Message Processing ---
-        # DEBUG LOG
-        # logger.debug(f"[Msg {message_id}/{chat_id}] Passed initial checks, proceeding to log.")
-
-        # 1. Log to Database
-        await log_message(
-            chat_id=chat_id,
-            chat_type=chat_type,
-            chat_title=chat_title,
-            chat_username=chat_username,
-            sender_id=sender_id,
-            sender_username=sender_username,
-            sender_first_name=sender_first_name,
-            sender_last_name=sender_last_name,
-            sender_is_bot=sender_is_bot,
-            message_id=message_id,
-            timestamp=timestamp,
-            text=text,
-            entities=serializable_entities, # Pass the serializable list
-            media_type=media_type,
-            media_info=media_info
-        )
-
-        # 2. Send Notification to *ALL* targets IF forwarding is active
-        if is_forwarding_active and event.client:
-            target_ids = await get_all_notification_target_ids()
-            if not target_ids:
-                 logger.warning(f"[Msg {message_id}/{chat_id}] No notification targets found (owner missing?). Skipping send.")
-                 return # Should not happen if owner is always added
-
-            logger.debug(f"[Msg {message_id}/{chat_id}] Checking forwarding: is_forwarding_active={is_forwarding_active}, Targets={target_ids}")
-
-            # Construct the message once
-            sender_display = f"{sender_first_name or ''} {sender_last_name or ''}".strip()
-            sender_display = sender_display or sender_username or f"ID:{sender_id}" if sender_id else "(Unknown Sender)"
-            if sender_is_bot:
-                sender_display += " [Bot]"
+        success = await remove_notification_target(target_id)
+        if success:
+            await _reload_notify_targets()
+            await event.reply(f"OK. Removed notification target: {args}")
+        else:
+            if target_id == OWNER_USER_ID:
+                await event.reply("Cannot remove the owner from notification targets.")
+            else:
+                await event.reply(f"Could not remove target {args}. Ensure it exists and is not the owner.")
+    except ValueError:
+         await event.reply(f"Error: Could not find user '{args}'. Please provide a valid user ID or username.")
+    except Exception as e:
+        await event.reply(f"Error removing notification target: {e}")
+        logger.error(f"Error in /notify_remove for '{args}': {e}", exc_info=True)
+    return
+
+async def _cmd_notify_list(event, args):
+    """Lists the notification targets."""
+    targets = await list_notification_targets()
+    if targets:
+        lines = ["Current Notification Targets:"]
+        for target in targets:
+            display = target['first_name'] or target['username'] or f"ID:{target['user_id']}"
+            if target['is_owner']: display += " (Owner)"
+            lines.append(f"- {display} (ID: {target['user_id']})")
+        await event.reply("\n".join(lines))
+    else:
+        await event.reply("Error: Could not retrieve notification targets (owner should always be present).")
+    return
+
+async def handle_command(event):
+    """Dispatches owner /commands.
+
+    Registered with from_users/pattern filters, so Telethon only invokes
+    this for the owner's slash messages — ordinary traffic never touches
+    command parsing at all.
+    """
+    text = event.message.text or ""
+    parts = text.split(maxsplit=1)
+    handler = _COMMANDS.get(parts[0].lower())
+    if handler is not None:
+        try:
+            await handler(event, parts[1] if len(parts) > 1 else "")
+        except Exception as e:
+            logger.error(f"Command {parts[0]} failed: {e}", exc_info=True)
+
+_COMMANDS = {
+    '/stop_forwarding': _cmd_stop_forwarding,
+    '/start_forwarding': _cmd_start_forwarding,
+    '/summary_today': _cmd_summary_today,
+    '/monitor_add': _cmd_monitor_add,
+    '/monitor_remove': _cmd_monitor_remove,
+    '/monitor_list': _cmd_monitor_list,
+    '/monitor_clear': _cmd_monitor_clear,
+    '/query': _cmd_query,
+    '/help': _cmd_help,
+    '/notify_add': _cmd_notify_add,
+    '/notify_remove': _cmd_notify_remove,
+    '/notify_list': _cmd_notify_list,
+}
+
+
+async def handle_new_message(event, *,
+                             # Invariant objects frozen as keyword defaults at
+                             # definition time: LOAD_FAST with no per-call
+                             # rebinding. Mutable module state (monitor set,
+                             # ignored senders) must NOT go here — those are
+                             # re-read at entry so runtime reloads take effect.
+                             _PeerUser=PeerUser,
+                             _User=User,
+                             _media_handlers=_MEDIA_HANDLERS,
+                             _link_types=_LINK_ENTITY_TYPES):
+    """Handles incoming messages: logs, processes commands, forwards notifications if active."""
+    # Bind hot module globals to locals once: LOAD_FAST instead of a
+    # LOAD_GLOBAL per reference in the per-message body below.
+    state = _state
+    seen = _seen
+    monitored = _monitored_ids
+    ignored = _IGNORED_SENDERS
+    owner_id = OWNER_USER_ID
 
-            chat_display = chat_title or chat_username or f"ID:{chat_id}"
+    sender = None
+    message = event.message
 
-            # Add indicators for links/media
-            content_indicators = []
-            if serializable_entities:
-                if any(e.get('type') in ['url', 'text_link'] for e in serializable_entities if isinstance(e, dict)):
-                     content_indicators.append("🔗Links")
-            if media_type:
-                content_indicators.append(f"🖼️Media ({media_type})")
-            indicator_str = f" [{', '.join(content_indicators)}]" if content_indicators else ""
+    # Drop re-delivered events (e.g. after a network hiccup/reconnect) before
+    # doing any work. A dict hit here is far cheaper than a duplicate DB row
+    # or, worse, a duplicate forward RPC.
+    seen_key = (event.chat_id, message.id)
+    if seen_key in seen:
+        seen.move_to_end(seen_key)
+        return
+    seen[seen_key] = None
+    if len(seen) > _SEEN_MAX:
+        seen.popitem(last=False)
+
+    # 1. Cheap scalars straight off the raw event — everything the
+    # gates below need is available without an entity round-trip.
+    chat_id = event.chat_id
+    sender_id = event.sender_id
+    message_id = message.id
+    timestamp = message.date # Already a datetime object
+    text = message.text # Or message.message
+    entities = message.entities # Can be None
+    media = message.media
+
+    # Owner commands are dispatched by handle_command via its own
+    # Telethon-level filter; skip them here so they aren't logged or
+    # forwarded as ordinary traffic.
+    if sender_id == owner_id and text and text[0] == '/':
+        return
+
+    # --- Monitoring Check --- (before any entity fetch, so filtered-out
+    # chats never pay for get_sender/get_chat or media parsing; an empty
+    # set means "monitor everything")
+    if monitored and chat_id not in monitored:
+        return
+    # -----------------------
+
+    # --- Prevent self-processing ---
+    if sender_id in ignored:
+        logger.debug("[Msg %s/%s] Ignoring self-sent message.", message_id, chat_id)
+        return
+
+    # 2. Resolve sender: prefer the one already attached to the update,
+    # then the local cache; only fall back to the awaited fetch on a
+    # cold miss.
+    sender = message.sender
+    if sender is None:
+        sender = _entity_cache_get(_sender_cache, sender_id)
+        if sender is None:
+            # Narrow catch: only the network fetch can legitimately fail
+            # here; Python-level bugs should surface, not be swallowed.
+            try:
+                sender = await event.get_sender()
+            except (RPCError, ConnectionError) as e:
+                logger.error(f"Failed to fetch sender {sender_id}: {e}")
+                return
+            _entity_cache_put(_sender_cache, sender_id, sender)
+    # Direct attribute loads behind one type test: almost every sender is a
+    # plain User, so the common path skips the getattr-with-default calls.
+    # Channel-as-sender (broadcast posts, anonymous admins) has no user
+    # fields and falls through to the defensive reads.
+    if type(sender) is _User:
+        sender_username = sender.username
+        sender_first_name = sender.first_name
+        sender_last_name = sender.last_name
+        sender_is_bot = sender.bot
+    else:
+        sender_username = getattr(sender, 'username', None)
+        sender_first_name = None
+        sender_last_name = None
+        sender_is_bot = False
+
+    # 3. Get Chat Info (for logging) — many events reuse the same chat, so
+    # keep resolved entities in-process instead of re-fetching from
+    # Telethon's session DB per message.
+    if type(event.peer_id) is _PeerUser:
+        # DM fast path: the "chat" of a private conversation is the sender
+        # we already resolved above, so skip event.get_chat() entirely.
+        chat = sender
+        chat_type = 'user'
+        chat_title = f"{sender_first_name or ''} {sender_last_name or ''}".strip() or None
+        chat_username = sender_username
+    else:
+        chat = message.chat
+        if chat is None:
+            chat = _entity_cache_get(_chat_entity_cache, chat_id)
+            if chat is None:
+                try:
+                    chat = await event.get_chat()
+                except (RPCError, ConnectionError) as e:
+                    logger.error(f"Failed to fetch chat {chat_id}: {e}")
+                    return
+                _entity_cache_put(_chat_entity_cache, chat_id, chat)
+        chat_title = getattr(chat, 'title', None) # Title for groups/channels
+        chat_username = getattr(chat, 'username', None)
 
-            forward_header = f"✉️ Received Msg{indicator_str}\nFrom: {chat_display} ({chat_type})\nBy: {sender_display}\nTime: {timestamp.strftime('%Y-%m-%d %H:%M:%S')}\nRef: {message_id} / {chat_id}\n---"
+        # Determine chat type (for logging), memoised per chat_id
+        chat_type = _chat_type_cache.get(chat_id)
+        if chat_type is None:
+            chat_type = _PEER_KIND.get(type(event.peer_id), 'unknown')
+            if chat_type is None:
+                # PeerChannel: supergroup or broadcast channel
+                chat_type = 'channel' if getattr(chat, 'broadcast', False) else 'group'
+            if chat_id is not None:
+                _chat_type_cache[chat_id] = chat_type
+
+    # Process media information. Most messages carry no media at all, so
+    # the None gate skips even the dispatch lookup on the common path.
+    media_type = None
+    media_info = None
+    if media is not None:
+        handler = _media_handlers.get(type(media))
+        if handler is not None:
+            media_type, media_info = handler(media)
+
+    # Only the link flag is needed inline; turning entities into dicts
+    # is deferred to the log writer (see _serialize_entities).
+    has_link = False
+    if entities:
+        for entity in entities:
+            if type(entity) in _link_types:
+                has_link = True
+                break
 
-            # Include text, or placeholder if only media
-            forward_body = text or f"(No text content - Media Type: {media_type or 'Unknown'})"
-            forward_message = f"{forward_header}\n{forward_body}"
+    # Basic console logging (optional, can be removed later).
+    # %-style args keep string formatting off the hot path when the
+    # level is filtered out (logging defers interpolation until emit).
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(
+            "New message in %s '%s' (ID: %s) from user '%s' (ID: %s): MsgID %s",
+            chat_type, chat_title or chat_username, chat_id,
+            sender_username or sender_id, sender_id, message_id,
+        )
 
-            # Limit message length
-            max_len = 4000 # Reduced slightly from absolute max
-            if len(forward_message) > max_len:
-                forward_message = forward_message[:max_len] + "... (truncated)"
 
-            successful_sends = 0
-            for target_id in target_ids:
-                try:
-                    logger.debug(f"[Msg {message_id}/{chat_id}] Attempting notification to target {target_id}.")
-                    await event.client.send_message(
-                        entity=target_id,
-                        message=forward_message,
-                        link_preview=False
-                    )
-                    successful_sends += 1
-                except UserIsBlockedError:
-                    logger.warning(f"Cannot send notification to {target_id}: User has blocked.")
-                except FloodWaitError as e:
-                     logger.warning(f"Flood wait sending notification to {target_id}. Waiting {e.seconds}s.")
-                     await asyncio.sleep(e.seconds + 1)
-                     # Consider retrying send to this user? For now, we skip.
-                except Exception as e:
-                    logger.error(f"[Msg {message_id}/{chat_id}] Failed to send notification to target {target_id}: {e}")
-
-            if successful_sends > 0:
-                 logger.info(f"[Msg {message_id}/{chat_id}] Notification sent to {successful_sends}/{len(target_ids)} targets.")
-                 # 4. Mark message as forwarded only if sent to at least one target
-                 await mark_message_forwarded(chat_id, message_id)
+    # --- Regular Message Processing ---
+    # (Monitor-list and self-message gates already ran above, before the
+    # entity fetches.)
+
+    # 4. Log to sequential buffer (if enabled) or database.
+    # The flat-file store turns the per-message DB round-trip into a
+    # single buffered sequential write; rows are indexed on rotation.
+    if _log_store is not None:
+        _log_store.append({
+            'chat_id': chat_id,
+            'chat_type': chat_type,
+            'chat_title': chat_title,
+            'chat_username': chat_username,
+            'sender_id': sender_id,
+            'sender_username': sender_username,
+            'sender_first_name': sender_first_name,
+            'sender_last_name': sender_last_name,
+            'sender_is_bot': sender_is_bot,
+            'message_id': message_id,
+            'timestamp': timestamp.isoformat() if timestamp else None,
+            'text': text,
+            'entities': _serialize_entities(entities),
+            'media_type': media_type,
+            'media_info': media_info,
+        })
+    else:
+        # Enqueue for the background bulk writer instead of paying a DB
+        # round-trip inline; the writer coalesces bursts into one commit.
+        record = {
+            'chat_id': chat_id,
+            'chat_type': chat_type,
+            'chat_title': chat_title,
+            'chat_username': chat_username,
+            'sender_id': sender_id,
+            'sender_username': sender_username,
+            'sender_first_name': sender_first_name,
+            'sender_last_name': sender_last_name,
+            'sender_is_bot': sender_is_bot,
+            'message_id': message_id,
+            'timestamp': timestamp,
+            'text': text,
+            'entities': entities, # Raw; serialized by the log writer
+            'media_type': media_type,
+            'media_info': media_info,
+        }
+        try:
+            _log_queue.put_nowait(record)
+        except asyncio.QueueFull:
+            # The writer has fallen 10k records behind; apply
+            # backpressure rather than dropping the message.
+            logger.warning("Log queue full; waiting for the DB writer to catch up.")
+            await _log_queue.put(record)
+
+    # 5. Send Notification to *ALL* targets IF forwarding is active for
+    # this chat (per-chat override, falling back to the global flag)
+    if _chat_notify.get(chat_id, state.forwarding):
+        # Construct the message once; display strings come from the
+        # per-sender/per-chat caches (also fixes the old precedence bug
+        # that discarded the name when sender_id was falsy).
+        sender_display = _sender_display_for(sender_id, sender_first_name, sender_last_name,
+                                             sender_username, sender_is_bot)
+        chat_display = _chat_display_for(chat_id, chat_title, chat_username)
+
+        # Add indicators for links/media (link flag computed during the
+        # entity pass above — no second scan, and no intermediate list:
+        # the four possible combinations are spelled out directly.
+        if has_link:
+            if media_type:
+                indicator_str = f" [🔗Links, 🖼️Media ({media_type})]"
             else:
-                 logger.warning(f"[Msg {message_id}/{chat_id}] Notification failed for all targets.")
+                indicator_str = " [🔗Links]"
+        elif media_type:
+            indicator_str = f" [🖼️Media ({media_type})]"
+        else:
+            indicator_str = ""
+
+        forward_header = _FWD_HEADER.format_map({
+            'indicator': indicator_str,
+            'chat_display': chat_display,
+            'chat_type': chat_type,
+            'sender_display': sender_display,
+            # LRU over the unix second: bursts reuse the cached string
+            'ts': _fmt_ts(int(timestamp.timestamp())),
+            'message_id': message_id,
+            'chat_id': chat_id,
+        })
+
+        # Include text, or placeholder if only media — truncated to the
+        # remaining budget *before* the concat, so a long message never
+        # allocates a multi-KB string just to be sliced down again.
+        forward_body = text or f"(No text content - Media Type: {media_type or 'Unknown'})"
+        body_budget = _FWD_MAX_LEN - len(forward_header)
+        if len(forward_body) > body_budget:
+            forward_body = forward_body[:body_budget] + _TRUNC_SUFFIX
+        forward_message = forward_header + forward_body
+
+        # Hand off to the digest worker: delivery is independent of the
+        # handler once the message text is built.
+        try:
+            _notify_queue.put_nowait((forward_message, chat_id, message_id))
+        except asyncio.QueueFull:
+            logger.warning(f"[Msg {message_id}/{chat_id}] Notification queue full; dropping notification.")
 
-    except Exception as e:
-        # Catch errors during message processing/logging itself
-        logger.error(f"Error processing message event {getattr(message, 'id', '?')}: {e}", exc_info=True)
 
     # TODO: Implement logic to check against webhook triggers based on the logged data or event
 
@@ -585,23 +1297,61 @@ async def start_observer(client: TelegramClient):
     """Registers handler and runs the client until disconnected."""
     # We assume client is connected and authorized by the calling function
 
-    # Register the event handler for new messages
-    client.add_event_handler(handle_new_message, events.NewMessage())
-    logger.info("Registered new message handler for all messages.")
+    # Share the client with the hot path and other modules
+    global _client
+    _client = client
+    client.state = _state  # Expose runtime state via event.client.state too
+
+    # Put the writer connection into WAL/NORMAL mode before the first
+    # event can hit the hot insert path.
+    try:
+        await configure_db_pragmas()
+    except Exception as e:
+        logger.error(f"Failed to configure DB pragmas: {e}", exc_info=True)
+
+    # Owner commands get their own handler with Telethon-level filters;
+    # everything else flows through the lightweight enqueueing handler
+    # and the worker pool.
+    client.add_event_handler(
+        handle_command,
+        events.NewMessage(from_users=OWNER_USER_ID, pattern=r'^/\w+'),
+    )
+    # The func= prefilter runs before Telethon schedules the handler, so
+    # in high-traffic chats outside the monitor list the event never even
+    # reaches the queue. It re-reads _monitored_ids each call, picking up
+    # /monitor_add//monitor_remove changes live; an empty set means
+    # "monitor everything" (same semantics as the in-handler gate, which
+    # stays as the authoritative check).
+    client.add_event_handler(
+        _enqueue_event,
+        events.NewMessage(func=lambda e: not _monitored_ids or e.chat_id in _monitored_ids),
+    )
+    if not _event_workers:
+        for i in range(_EVENT_WORKER_COUNT):
+            _event_workers.append(asyncio.create_task(_event_worker(), name=f"EventWorker-{i}"))
+    logger.info(f"Registered new message handler ({_EVENT_WORKER_COUNT} workers) for all messages.")
 
     # Store bot's own ID if not already done (might be redundant but safe)
-    global _BOT_USER_ID
-    if _BOT_USER_ID is None:
+    global _IGNORED_SENDERS
+    if not _IGNORED_SENDERS:
         try:
             me = await client.get_me()
             if me:
-                _BOT_USER_ID = me.id
-                logger.info(f"Observer confirmed login as: {me.username} (ID: {_BOT_USER_ID})")
+                _IGNORED_SENDERS = frozenset({me.id})
+                logger.info(f"Observer confirmed login as: {me.username} (ID: {me.id})")
             else:
                  logger.warning("Could not get self user in start_observer, self-checks might fail.")
         except Exception as e:
             logger.error(f"Error getting self user in start_observer: {e}")
 
+    # Seed the in-memory monitor/notify mirrors so the first messages don't
+    # hit the DB for membership checks.
+    try:
+        await _reload_monitored()
+        await _reload_notify_targets()
+    except Exception as e:
+        logger.error(f"Failed to preload monitor/notify caches: {e}", exc_info=True)
+
     # --- Group Joining Logic --- (Moved back here)
     config = getattr(client, 'app_config', None)
     if not config:
@@ -609,36 +1359,122 @@ async def start_observer(client: TelegramClient):
          # Decide how to handle this - maybe stop?
          return
 
+    # --- Sequential Log Buffer Setup ---
+    global _log_store
+    if config.sequential_log_buffer and _log_store is None:
+        _log_store = SequentialLogStore()
+        logger.info("Sequential log buffer enabled; messages will be journaled to flat files.")
+    # -----------------------------------
+
+    # --- DB Bulk Writer Setup ---
+    global _log_writer_task
+    if _log_writer_task is None:
+        _log_writer_task = asyncio.create_task(_log_writer(), name="LogBulkWriter")
+        logger.info("Started background DB log writer task.")
+    # ----------------------------
+
+    # --- Notification Digest Worker Setup ---
+    global _notify_worker_task
+    if _notify_worker_task is None:
+        _notify_worker_task = asyncio.create_task(_notify_worker(), name="NotifyDigestWorker")
+        logger.info("Started background notification digest worker.")
+    # ----------------------------------------
+
+    # --- Monitor Cache Fallback Refresher ---
+    global _monitor_refresher_task
+    if _monitor_refresher_task is None:
+        _monitor_refresher_task = asyncio.create_task(_monitor_refresher(), name="MonitorCacheRefresher")
+    # ----------------------------------------
+
     if config.telegram_groups:
         logger.info(f"Attempting to join configured groups: {config.telegram_groups}")
-        joined_groups = 0
-        failed_groups = []
-        for group_identifier in config.telegram_groups:
-            try:
-                logger.debug(f"Attempting to join: {group_identifier}")
-                entity = await client.get_entity(group_identifier)
-                await client(JoinChannelRequest(entity))
-                logger.info(f"Successfully joined or already in group: {group_identifier} (ID: {entity.id})")
-                joined_groups += 1
-            except UserAlreadyParticipantError:
-                logger.info(f"Already a participant in: {group_identifier}")
-                joined_groups += 1
-            except (ChannelInvalidError, ChannelPrivateError, InviteHashExpiredError, ValueError) as e:
-                logger.warning(f"Cannot join group '{group_identifier}': {type(e).__name__} - {e}. Might be private, invalid link, or require invite.")
-                failed_groups.append(group_identifier)
-            except ChannelsTooMuchError:
-                logger.error("Cannot join more groups. Account limit reached.")
-                failed_groups.append(group_identifier)
-                # Stop trying if limit reached
-                break
-            except FloodWaitError as e:
-                logger.warning(f"Flood wait joining {group_identifier}. Waiting {e.seconds}s.")
-                failed_groups.append(group_identifier)
-                await asyncio.sleep(e.seconds + 1)
-            except Exception as e:
-                logger.error(f"Failed to join group {group_identifier}: {e}", exc_info=True)
-                failed_groups.append(group_identifier)
-            await asyncio.sleep(1) # Small delay between join attempts
+        # Joins are independent MTProto RPCs, so overlap them under a small
+        # semaphore instead of paying one RTT (plus a fixed sleep) per group
+        # serially. The semaphore keeps concurrency low enough to stay
+        # rate-limit friendly.
+        join_sem = asyncio.Semaphore(5)
+        limit_reached = asyncio.Event()
+
+        # Resolve every identifier up-front and concurrently so the join
+        # phase doesn't serialize one ResolveUsername RTT per group; a
+        # resolution failure surfaces through the existing ladder below.
+        # Ids persisted from earlier runs skip the network resolve entirely
+        # (an input entity is all JoinChannelRequest needs).
+        known_ids = _load_entity_ids()
+
+        async def _resolve_group(group_identifier):
+            cached_id = known_ids.get(group_identifier)
+            if cached_id is not None:
+                try:
+                    return await client.get_input_entity(cached_id)
+                except Exception:
+                    pass  # Stale cache entry; fall through to a full resolve.
+            return await client.get_entity(group_identifier)
+
+        resolved = await asyncio.gather(
+            *[_resolve_group(g) for g in config.telegram_groups],
+            return_exceptions=True,
+        )
+        cache_dirty = False
+        for g, ent in zip(config.telegram_groups, resolved):
+            ent_id = getattr(ent, 'id', None)
+            if ent_id is not None and known_ids.get(g) != ent_id:
+                known_ids[g] = ent_id
+                cache_dirty = True
+        if cache_dirty:
+            _save_entity_ids(known_ids)
+
+        async def _join_one(group_identifier, entity):
+            # One flood-wait retry: the server tells us exactly how long to
+            # wait, and giving up instead would leave the group unjoined
+            # until the next restart. The sleep happens outside the
+            # semaphore so other joins keep flowing meanwhile.
+            for attempt in range(2):
+                wait_s = None
+                async with join_sem:
+                    if limit_reached.is_set():
+                        return False
+                    try:
+                        logger.debug("Attempting to join: %s", group_identifier)
+                        if isinstance(entity, BaseException):
+                            raise entity
+                        await client(JoinChannelRequest(entity))
+                        # Cached input entities carry channel_id rather than
+                        # id, hence the defensive read for the log line.
+                        logger.info(f"Successfully joined or already in group: {group_identifier} (ID: {getattr(entity, 'id', None) or getattr(entity, 'channel_id', '?')})")
+                        # Polite spacing while still holding the semaphore keeps
+                        # the aggregate join rate well under flood thresholds.
+                        await asyncio.sleep(0.2)
+                        return True
+                    except UserAlreadyParticipantError:
+                        logger.info(f"Already a participant in: {group_identifier}")
+                        return True
+                    except (ChannelInvalidError, ChannelPrivateError, InviteHashExpiredError, ValueError) as e:
+                        logger.warning(f"Cannot join group '{group_identifier}': {type(e).__name__} - {e}. Might be private, invalid link, or require invite.")
+                        return False
+                    except ChannelsTooMuchError:
+                        logger.error("Cannot join more groups. Account limit reached.")
+                        # Stop remaining attempts if limit reached
+                        limit_reached.set()
+                        return False
+                    except FloodWaitError as e:
+                        if attempt == 1:
+                            logger.error(f"Still flood-limited joining {group_identifier} after retry; giving up.")
+                            return False
+                        wait_s = e.seconds + 1
+                        logger.warning(f"Flood wait joining {group_identifier}. Retrying in {e.seconds}s.")
+                    except Exception as e:
+                        logger.error(f"Failed to join group {group_identifier}: {e}", exc_info=True)
+                        return False
+                await asyncio.sleep(wait_s)
+            return False
+
+        results = await asyncio.gather(
+            *[_join_one(g, e) for g, e in zip(config.telegram_groups, resolved)],
+            return_exceptions=True,
+        )
+        joined_groups = sum(1 for r in results if r is True)
+        failed_groups = [g for g, r in zip(config.telegram_groups, results) if r is not True]
 
         logger.info(f"Finished group joining. Joined/In {joined_groups} groups.")
         if failed_groups:
@@ -651,4 +1487,21 @@ async def start_observer(client: TelegramClient):
     try:
         await client.run_until_disconnected()
     finally:
+        if _log_writer_task is not None:
+            # Flush whatever the writer hasn't committed yet before stopping.
+            try:
+                await asyncio.wait_for(_log_queue.join(), timeout=10)
+            except asyncio.TimeoutError:
+                logger.warning("Timed out flushing pending log records on shutdown.")
+            _log_writer_task.cancel()
+        if _notify_worker_task is not None:
+            _notify_worker_task.cancel()
+        if _monitor_refresher_task is not None:
+            _monitor_refresher_task.cancel()
+        for worker in _event_workers:
+            worker.cancel()
+        _event_workers.clear()
+        await close_write_db()
+        if _log_store is not None:
+            await _log_store.close()
         logger.info("Observer client run_until_disconnected finished.")
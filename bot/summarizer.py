@@ -1,5 +1,9 @@
 import logging
 import json
+import collections # For the summary LRU cache and keyword counting
+import hashlib
+import re
+import struct
 from datetime import datetime
 from typing import List, Dict, Any, Optional
 
@@ -32,6 +36,20 @@ SUPPORTED_FILTERS = {
     "limit": "integer (max number of results, default 25)"
 }
 
+# AsyncOpenAI wraps an httpx connection pool; constructing one per call threw
+# the pool away between requests. Cache per (base_url, api_key) so repeat
+# summaries/extractions reuse keep-alive connections.
+_ai_clients: Dict[tuple, AsyncOpenAI] = {}
+
+async def close_ai_clients():
+    """Closes all cached AI clients (call once on shutdown)."""
+    for client in _ai_clients.values():
+        try:
+            await client.close()
+        except Exception as e:
+            logger.debug("Error closing AI client: %s", e)
+    _ai_clients.clear()
+
 async def get_ai_client(config: Config, use_openrouter: bool = False) -> Optional[AsyncOpenAI]:
     """Helper to get configured AsyncOpenAI client for primary AI or OpenRouter."""
     api_key = None
@@ -52,8 +70,13 @@ async def get_ai_client(config: Config, use_openrouter: bool = False) -> Optiona
             logger.error("Primary AI API Base (AI_API_BASE) or Key (AI_API_KEY) not configured.")
             return None
 
+    cache_key = (base_url, api_key)
+    client = _ai_clients.get(cache_key)
+    if client is not None:
+        return client
+
     try:
-        logger.debug(f"Initializing {client_name} client with base_url: {base_url}")
+        logger.debug("Initializing %s client with base_url: %s", client_name, base_url)
         # Add custom headers for OpenRouter if needed (e.g., referral)
         headers = None
         if use_openrouter:
@@ -62,30 +85,100 @@ async def get_ai_client(config: Config, use_openrouter: bool = False) -> Optiona
                 "X-Title": "AssetmaticMicro1", # Optional: Replace with your project title
             }
 
-        return AsyncOpenAI(
+        client = AsyncOpenAI(
             base_url=base_url,
             api_key=api_key,
             default_headers=headers # Pass headers if defined
         )
+        _ai_clients[cache_key] = client
+        return client
     except Exception as e:
         logger.error(f"Failed to initialize {client_name} client: {e}")
         return None
 
+def format_message_for_prompt(msg: Dict[str, Any]) -> str:
+    """Formats one logged message as a single summarization prompt line."""
+    sender = msg.get('sender_name', 'Unknown')
+    chat = msg.get('chat_title', 'Unknown Chat')
+    text = msg.get('text', '(no text)')
+    media = f" [Media: {msg.get('media_type')}]" if msg.get('media_type') else ""
+    timestamp = msg.get('timestamp', 'Unknown Time')
+    ts_str = timestamp.isoformat() if isinstance(timestamp, datetime) else str(timestamp)
+    return f"- [{ts_str}] In '{chat}' by {sender}: {text}{media}"
+
+# Prompt condensation: past a size threshold, keep the first few and the most
+# recent messages verbatim and collapse the middle into one topic line. The
+# tail carries most of the summary's value; blind truncation used to throw
+# it away whenever the window was busy.
+_CONDENSE_THRESHOLD = 20_000  # total text chars before the middle is condensed
+_HEAD_KEEP = 5
+_TAIL_KEEP = 30
+_WORD_RE = re.compile(r'[a-zA-Z]{4,}')
+
+def _condense_middle(middle: List[Dict[str, Any]]) -> str:
+    """Collapses a run of messages into one line of recurring terms."""
+    counts: collections.Counter = collections.Counter()
+    for m in middle:
+        text = m.get('text')
+        if text:
+            counts.update(_WORD_RE.findall(text.lower()))
+    top = ', '.join(word for word, _ in counts.most_common(5))
+    return f"[... {len(middle)} messages condensed; recurring terms: {top or 'n/a'} ...]"
+
+def _select_for_prompt(messages: List[Dict[str, Any]]):
+    """Returns (head, condensed_line_or_None, tail) for prompt assembly."""
+    if len(messages) > _HEAD_KEEP + _TAIL_KEEP:
+        total_chars = sum(len(m.get('text') or '') for m in messages)
+        if total_chars > _CONDENSE_THRESHOLD:
+            middle = messages[_HEAD_KEEP:-_TAIL_KEEP]
+            return messages[:_HEAD_KEEP], _condense_middle(middle), messages[-_TAIL_KEEP:]
+    return messages, None, []
+
+# Exact-match summary cache: logged messages are immutable, so the same
+# (message set, model) pair always yields an equivalent summary — retries and
+# overlapping windows can reuse it instead of paying another LLM round-trip.
+_SUMMARY_CACHE_MAX = 256
+_summary_cache: collections.OrderedDict = collections.OrderedDict()
+
+def _summary_cache_key(messages: List[Dict[str, Any]], model_name: str) -> str:
+    """Hashes the sorted (chat_id, message_id) set plus model into a cache key."""
+    h = hashlib.blake2b(digest_size=16)
+    for m in sorted(messages, key=lambda x: (x.get('chat_id') or 0, x.get('message_id') or 0)):
+        h.update(struct.pack('<qq', m.get('chat_id') or 0, m.get('message_id') or 0))
+    h.update(model_name.encode())
+    return h.hexdigest()
+
+def _summary_cache_put(key: str, summary: str):
+    if len(_summary_cache) >= _SUMMARY_CACHE_MAX:
+        _summary_cache.popitem(last=False)
+    _summary_cache[key] = summary
+
 async def get_ai_summary(config: Config, messages: List[Dict[str, Any]]) -> str:
     """Generates an AI summary for the given list of messages, with OpenRouter fallback."""
     if not messages:
         return "No new messages to summarize."
 
-    # Prepare context (same for both primary and fallback)
-    prompt_context = "Summarize the key points from the following messages. Be concise.\n\n"
-    for msg in messages:
-        sender = msg.get('sender_name', 'Unknown')
-        chat = msg.get('chat_title', 'Unknown Chat')
-        text = msg.get('text', '(no text)')
-        media = f" [Media: {msg.get('media_type')}]" if msg.get('media_type') else ""
-        timestamp = msg.get('timestamp', 'Unknown Time')
-        ts_str = timestamp.isoformat() if isinstance(timestamp, datetime) else str(timestamp)
-        prompt_context += f"- [{ts_str}] In '{chat}' by {sender}: {text}{media}\n"
+    cache_key = _summary_cache_key(messages, config.ai_model_name)
+    cached = _summary_cache.get(cache_key)
+    if cached is not None:
+        _summary_cache.move_to_end(cache_key)
+        logger.info("Returning cached AI summary for identical message set.")
+        return cached
+
+    # Prepare context (same for both primary and fallback). Oversized
+    # windows keep head and tail verbatim with the middle condensed to a
+    # topic line, instead of truncating away the most recent traffic.
+    head, condensed, tail = _select_for_prompt(messages)
+    # Rows carry a prompt_line pre-rendered at ingest; formatting on the fly
+    # is only the fallback for rows logged before the column existed. The
+    # parts list keeps assembly O(N) — += on a string re-copies the whole
+    # prompt per message.
+    parts = ["Summarize the key points from the following messages. Be concise.\n"]
+    parts.extend(msg.get('prompt_line') or format_message_for_prompt(msg) for msg in head)
+    if condensed:
+        parts.append(condensed)
+        parts.extend(msg.get('prompt_line') or format_message_for_prompt(msg) for msg in tail)
+    prompt_context = "\n".join(parts) + "\n"
 
     async def attempt_summary(use_openrouter: bool = False):
         client = await get_ai_client(config, use_openrouter=use_openrouter)
@@ -113,7 +206,7 @@ async def get_ai_summary(config: Config, messages: List[Dict[str, Any]]) -> str:
                 temperature=0.5,
             )
 
-            logger.debug(f"Raw {provider_name} completion object: {chat_completion}")
+            logger.debug("Raw %s completion object: %s", provider_name, chat_completion)
 
             if not chat_completion or not chat_completion.choices:
                 logger.warning(f"{provider_name} completion has no choices. Response: {chat_completion}")
@@ -136,6 +229,7 @@ async def get_ai_summary(config: Config, messages: List[Dict[str, Any]]) -> str:
     # --- Try Primary First ---
     summary, error = await attempt_summary(use_openrouter=False)
     if summary is not None:
+        _summary_cache_put(cache_key, summary)
         return summary
 
     logger.warning(f"Primary AI summary failed: {error}. Attempting fallback with OpenRouter...")
@@ -144,6 +238,7 @@ async def get_ai_summary(config: Config, messages: List[Dict[str, Any]]) -> str:
     if config.openrouter_api_key: # Only attempt if key is configured
         summary_fallback, error_fallback = await attempt_summary(use_openrouter=True)
         if summary_fallback is not None:
+            _summary_cache_put(cache_key, summary_fallback)
             return summary_fallback
         else:
             logger.error(f"OpenRouter fallback summary also failed: {error_fallback}")
@@ -197,7 +292,7 @@ Convert the user's query into a JSON object containing ONLY the relevant filter
                 temperature=0.1,
                 max_tokens=200
             )
-            logger.debug(f"Raw {provider_name} completion object for extraction: {chat_completion}")
+            logger.debug("Raw %s completion object for extraction: %s", provider_name, chat_completion)
 
             if not chat_completion or not chat_completion.choices:
                 logger.warning(f"{provider_name} extraction has no choices. Response: {chat_completion}")
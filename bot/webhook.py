@@ -8,6 +8,25 @@ logger = logging.getLogger(__name__)
 
 # Configure httpx client
 _TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=64)
+
+# One client for the process lifetime: a fresh AsyncClient per send would pay
+# a TCP+TLS handshake every call and throw away the keep-alive pool.
+_client: httpx.AsyncClient | None = None
+
+def get_client() -> httpx.AsyncClient:
+    """Returns the shared AsyncClient, creating it on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(timeout=_TIMEOUT, limits=_LIMITS)
+    return _client
+
+async def close_client():
+    """Closes the shared client (call once on shutdown)."""
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
 
 async def send_webhook(config: Config, payload_data: List[Dict[str, Any]]) -> bool:
     """Sends the given list of message data as JSON to the configured webhook URL."""
@@ -25,11 +44,11 @@ async def send_webhook(config: Config, payload_data: List[Dict[str, Any]]) -> bo
     }
 
     try:
-        async with httpx.AsyncClient(timeout=_TIMEOUT) as client:
-            response = await client.post(config.webhook_url, json=payload)
-            response.raise_for_status()
-            logger.info(f"Webhook batch sent successfully to {config.webhook_url}. Status: {response.status_code}")
-            return True
+        client = get_client()
+        response = await client.post(config.webhook_url, json=payload)
+        response.raise_for_status()
+        logger.info(f"Webhook batch sent successfully to {config.webhook_url}. Status: {response.status_code}")
+        return True
 
     except httpx.TimeoutException:
         logger.error(f"Webhook request timed out for URL: {config.webhook_url}")
@@ -1,6 +1,15 @@
 import asyncio
 import logging
 import uvicorn # Need uvicorn to run FastAPI
+
+# Use uvloop's libuv-backed event loop when available (Linux/macOS).
+# The whole app is asyncio-bound (Telethon MTProto reads, DB writes, httpx),
+# so the faster loop benefits every await with zero code changes.
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    uvloop = None
 from datetime import datetime, timedelta
 from telethon import TelegramClient # Import client for sending summary
 from telethon.errors import UserIsBlockedError, FloodWaitError # Errors for sending message
@@ -12,8 +21,8 @@ from bot.config import load_config, Config
 from bot.observer import start_observer # Only need start_observer here
 # Logger functions needed by scheduler or command handler (which runs via observer)
 from bot.logger import initialize_db, get_messages_since, get_all_notification_target_ids
-from bot.summarizer import get_ai_summary # Import AI summarizer
-from bot.webhook import send_webhook # Re-import webhook sender
+from bot.summarizer import get_ai_summary, close_ai_clients # Import AI summarizer
+from bot.webhook import send_webhook, close_client # Re-import webhook sender
 
 # API logic
 from api.main import app as fastapi_app # Import the FastAPI app instance
@@ -26,6 +35,8 @@ logging.getLogger("uvicorn.access").setLevel(logging.WARNING)
 logging.getLogger("httpx").setLevel(logging.WARNING)
 
 logger = logging.getLogger(__name__)
+if uvloop is not None:
+    logger.debug("uvloop event loop policy installed.")
 
 # --- Combined Scheduler Task ---
 async def periodic_task_scheduler(config: Config, client: TelegramClient):
@@ -80,7 +91,7 @@ async def periodic_task_scheduler(config: Config, client: TelegramClient):
                     for target_id in target_ids:
                         try:
                             await client.send_message(entity=target_id, message=full_summary_message)
-                            logger.debug(f"Sent summary to target {target_id}")
+                            logger.debug("Sent summary to target %s", target_id)
                         except (UserIsBlockedError, FloodWaitError) as e:
                             logger.warning(f"Error sending summary to target {target_id}: {e}")
                             if isinstance(e, FloodWaitError): await asyncio.sleep(e.seconds + 1)
@@ -118,15 +129,18 @@ async def run_observer_and_scheduler(config: Config):
     client.app_config = config # Attach config for handler access
     logger.info(f"Initializing TelegramClient: {session_name}")
 
-    # Retry connection logic needs to be here before starting tasks
+    # Retry connection logic needs to be here before starting tasks.
+    # Timeouts bound a hung TCP/TLS handshake (otherwise connect() can block
+    # forever) and the delay backs off exponentially to be gentler on
+    # Telegram's DCs during an outage.
     max_retries = 3
     retry_delay = 5
     connected = False
     for attempt in range(max_retries):
         try:
-            logger.debug(f"Connection attempt {attempt + 1}/{max_retries}...")
-            await client.connect()
-            if await client.is_user_authorized():
+            logger.debug("Connection attempt %d/%d...", attempt + 1, max_retries)
+            await asyncio.wait_for(client.connect(), timeout=15)
+            if await asyncio.wait_for(client.is_user_authorized(), timeout=10):
                 logger.info("Client connected and authorized.")
                 connected = True
                 break
@@ -136,14 +150,21 @@ async def run_observer_and_scheduler(config: Config):
                 logger.warning("Client connected but not authorized. Manual login might be required.")
                 connected = True # Treat as connected for now, observer might fail later if still unauthorized
                 break
+        except asyncio.TimeoutError:
+            logger.error(f"Connection attempt {attempt + 1} timed out.")
+            if attempt + 1 == max_retries: break
+            await asyncio.sleep(retry_delay)
+            retry_delay *= 2
         except ConnectionError as e:
             logger.error(f"Connection attempt {attempt + 1} failed: {e}")
             if attempt + 1 == max_retries: break
             await asyncio.sleep(retry_delay)
+            retry_delay *= 2
         except Exception as e:
              logger.exception(f"Unexpected error during connection attempt {attempt + 1}:", exc_info=e)
              if attempt + 1 == max_retries: break
              await asyncio.sleep(retry_delay)
+             retry_delay *= 2
 
     if not connected:
         logger.critical("Failed to connect to Telegram after multiple retries. Exiting bot runner.")
@@ -219,6 +240,8 @@ async def launch_bot_and_api():
     for task in done:
         if task.exception(): logger.exception(f"Task {task.get_name()} failed:", exc_info=task.exception())
 
+    await close_client() # Release the pooled webhook connections
+    await close_ai_clients() # ...and the cached AI client pools
     logger.info(f"Bot instance {config.bot_name} shutdown complete.")
 
 if __name__ == "__main__":